@@ -2,3 +2,8 @@
 __github__ = 'https://github.com/acgnhiki/blrec/tree/master/src/blrec/bili'
 
 from .danmaku_client import *
+from .decoder import *
+from .command_filter import *
+from .heartbeat import *
+from .reconnect import *
+from .danmu_info import *
@@ -0,0 +1,62 @@
+import re
+from collections import Counter
+from typing import Any, Final, Iterable, Optional
+
+__all__ = 'CommandFilter', 'command_stats'
+
+
+_CMD_PATTERN: Final = re.compile(rb'"cmd"\s*:\s*"([^"]+)"')
+
+
+class CommandStats:
+    def __init__(self) -> None:
+        self.parsed: Counter[bytes] = Counter()
+        self.skipped: Counter[bytes] = Counter()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            'parsed': {k.decode(): v for k, v in self.parsed.items()},
+            'skipped': {k.decode(): v for k, v in self.skipped.items()},
+        }
+
+
+# shared by every client of the process
+command_stats = CommandStats()
+
+
+class CommandFilter:
+    """Decides from the raw packet whether it is worth `json.loads`-ing.
+
+    Only a window at the head of the packet is scanned, bilibili puts `cmd`
+    first. Packets whose command can't be found are always parsed.
+    `DANMU_MSG:4:0:2:2:2:0` style variants match on the part before `:`.
+    """
+
+    SCAN_WINDOW: Final[int] = 64
+
+    __slots__ = '_commands',
+
+    def __init__(self, commands: Optional[Iterable[str]] = None) -> None:
+        self._commands = (
+            None if commands is None else frozenset(c.encode() for c in commands)
+        )
+
+    @classmethod
+    def from_listeners(cls, listeners: Iterable[Any]) -> 'CommandFilter':
+        commands: set[str] = set()
+        for listener in listeners:
+            if listener.commands is None:
+                return cls()
+            commands |= listener.commands
+        return cls(commands)
+
+    def wants(self, packet: bytes) -> bool:
+        m = _CMD_PATTERN.search(packet, 0, self.SCAN_WINDOW)
+        if m is None:
+            return True
+        cmd = m.group(1).partition(b':')[0]
+        if self._commands is None or cmd in self._commands:
+            command_stats.parsed[cmd] += 1
+            return True
+        command_stats.skipped[cmd] += 1
+        return False
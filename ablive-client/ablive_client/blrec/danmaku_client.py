@@ -1,20 +1,26 @@
 import asyncio
 import orjson as json
 import logging
-import struct
-from contextlib import suppress
-from enum import Enum, IntEnum
-from typing import Any, Dict, Final, List, Mapping, Optional, Tuple, Union, cast
+from contextlib import nullcontext, suppress
+from enum import Enum
+from typing import (
+    Any, AsyncContextManager, Dict, Final, List, Mapping, Optional, Tuple, cast
+)
 
 import aiohttp
-import brotli
 from aiohttp import ClientSession
-from tenacity import retry, retry_if_exception_type, wait_exponential
 
-from .api import WebApi
+from .command_filter import CommandFilter
+from .danmu_info import DanmuInfoService
+from .decoder import FrameDecoder
 from .event_emitter import EventEmitter, EventListener
+from .frame import WS, Frame
+from .heartbeat import HeartbeatWheel
+from .reconnect import ReconnectGovernor
 
-__all__ = 'DanmakuClient', 'DanmakuCommand', 'Danmaku', 'DanmakuListener'
+__all__ = (
+    'DanmakuClient', 'DanmakuCommand', 'Danmaku', 'DanmakuListener', 'client_states'
+)
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +30,9 @@ Danmaku = Mapping[str, Any]
 
 
 class DanmakuListener(EventListener):
+    # `cmd`s the listener consumes, None for all of them
+    commands: Optional[frozenset[str]] = None
+
     async def on_client_connected(self) -> None:
         ...
 
@@ -36,57 +45,140 @@ class DanmakuListener(EventListener):
     async def on_danmaku_received(self, danmu: Danmaku) -> None:
         ...
 
+    async def on_danmaku_batch(self, liverid: int, danmus: List[Danmaku]) -> None:
+        # all packets of one frame, override to avoid a dispatch per packet
+        for danmu in danmus:
+            await self.on_danmaku_received(danmu)
+
     async def on_error_occurred(self, error: Exception) -> None:
         ...
 
 
+class ClientStates:
+    CONNECTING: Final = 'connecting'
+    CONNECTED: Final = 'connected'
+    FAILED: Final = 'failed'
+
+    def __init__(self) -> None:
+        self.states: Dict[Tuple[int, int], str] = {}
+        self.reconnects = 0
+
+    def stats(self) -> Dict[str, int]:
+        counts = dict.fromkeys((self.CONNECTING, self.CONNECTED, self.FAILED), 0)
+        for state in self.states.values():
+            counts[state] += 1
+        return {**counts, 'reconnects': self.reconnects}
+
+
+# shared by every client of the process
+client_states = ClientStates()
+
+
 class DanmakuClient(EventEmitter[DanmakuListener]):
     _HEARTBEAT_INTERVAL: Final[int] = 30
     _HEADERS = {'Connection': 'Upgrade'}
     _MAX_RETRIES: Final[int] = 1000
 
-    __slots__ = ("session", "_room_id", "_liverid", "_danmu_info", "_host_index", "_retry_count", "_retry_delay", "_ws")
+    __slots__ = ("session", "_room_id", "_liverid", "_key", "_danmu_info", "_host_index", "_retry_count", "_retry_delay", "_ws", "_decoder", "_filter", "_heartbeat", "_governor", "_danmu_info_service")
 
     def __init__(
         self,
         session: ClientSession,
         liverid: int,
         room_id: int,
+        decoder: Optional[FrameDecoder] = None,
+        heartbeat: Optional[HeartbeatWheel] = None,
+        governor: Optional[ReconnectGovernor] = None,
+        danmu_info_service: Optional[DanmuInfoService] = None,
     ) -> None:
         super().__init__()
         self.session = session
         self._room_id = room_id
         self._liverid = liverid
+        # a room may reappear under another room_id, the old client's
+        # registrations must not hit the new one
+        self._key = (liverid, room_id)
+        self._decoder = decoder or FrameDecoder.shared()
+        self._filter: Optional[CommandFilter] = None
+        self._heartbeat = heartbeat or HeartbeatWheel.shared()
+        self._governor = governor or ReconnectGovernor.shared()
+        self._danmu_info_service = danmu_info_service or DanmuInfoService.shared()
 
         self._danmu_info: Dict[str, Any] = COMMON_DANMU_INFO
         self._host_index: int = 0
         self._retry_count = 0
-        self._retry_delay: int = 0
+        self._retry_delay: float = 0
+        self._message_loop_task: Optional[asyncio.Task] = None
 
-    async def _do_start(self) -> None:
-        await self._update_danmu_info()
-        await self._connect()
+    def add_listener(self, listener: DanmakuListener) -> None:
+        super().add_listener(listener)
+        self._filter = None
+
+    def remove_listener(self, listener: DanmakuListener) -> None:
+        super().remove_listener(listener)
+        self._filter = None
+
+    async def _do_start(
+        self, admission: Optional[AsyncContextManager[Any]] = None
+    ) -> None:
+        """`admission` is held for the info fetch and the first connect
+        attempt only, the retries after that go on without it."""
+        client_states.states[self._key] = ClientStates.CONNECTING
+        async with admission or nullcontext():
+            await self._update_danmu_info()
+            connected = await self._connect_once()
+        if not connected:
+            delay = self._governor.backoff(0.0)
+            await asyncio.sleep(delay)
+            await self._connect(delay)
+        client_states.states[self._key] = ClientStates.CONNECTED
         await self._create_message_loop()
         logger.debug('Started danmaku client')
 
     async def _do_stop(self) -> None:
         await self._terminate_message_loop()
         await self._disconnect()
+        client_states.states.pop(self._key, None)
         logger.debug('Stopped danmaku client')
 
     async def reconnect(self) -> None:
         logger.debug('Reconnecting...')
+        client_states.reconnects += 1
+        client_states.states[self._key] = ClientStates.CONNECTING
         await self._disconnect()
         await self._connect()
+        client_states.states[self._key] = ClientStates.CONNECTED
         await self._emit('client_reconnected')
 
-    @retry(
-        wait=wait_exponential(multiplier=0.1, max=10),
-        retry=retry_if_exception_type(
-            (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError)
-        ),
-    )
-    async def _connect(self) -> None:
+    async def _connect(self, delay: float = 0.0) -> None:
+        while not await self._connect_once():
+            delay = self._governor.backoff(delay)
+            await asyncio.sleep(delay)
+
+    async def _connect_once(self) -> bool:
+        await self._governor.acquire()
+        if not self._skip_open_hosts():
+            await asyncio.sleep(self._governor.retry_after(
+                h['host'] for h in self._danmu_info['host_list']
+            ))
+        host = self._danmu_info['host_list'][self._host_index]['host']
+        try:
+            await self._try_connect()
+        except (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError):
+            self._governor.record_failure(host)
+            return False
+        self._governor.record_success(host)
+        return True
+
+    def _skip_open_hosts(self) -> bool:
+        host_list = self._danmu_info['host_list']
+        for _ in range(len(host_list)):
+            if self._governor.available(host_list[self._host_index]['host']):
+                return True
+            self._host_index = (self._host_index + 1) % len(host_list)
+        return False
+
+    async def _try_connect(self) -> None:
         logger.debug('Connecting to server...')
         try:
             await self._connect_websocket()
@@ -97,7 +189,7 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
             self._host_index += 1
             if self._host_index >= len(self._danmu_info['host_list']):
                 self._host_index = 0
-                await self._update_danmu_info()
+                await self._update_danmu_info(refresh=True)
             raise
         else:
             logger.debug('Connected to server')
@@ -161,17 +253,13 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
 
         if code == WS.AUTH_OK:
             logger.debug('Auth OK')
-            self._create_heartbeat_task()
+            self._start_heartbeat()
 
-    async def _update_danmu_info(self) -> None:
-        api = WebApi(self.session)
+    async def _update_danmu_info(self, refresh: bool = False) -> None:
         try:
-            # self._danmu_info = await api.get_danmu_info(self._room_id)
-            _chat_conf = await api.get_chat_conf(self._room_id)
-            self._danmu_info = {
-                "token": _chat_conf['token'],
-                "host_list": _chat_conf['host_server_list'],
-            }
+            self._danmu_info = await self._danmu_info_service.get(
+                self._room_id, refresh=refresh
+            )
         except Exception as exc:
             logger.warning(f'Failed to update danmu info: {repr(exc)}')
             self._danmu_info = COMMON_DANMU_INFO
@@ -179,7 +267,7 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
             logger.debug('Danmu info updated')
 
     async def _disconnect(self) -> None:
-        await self._cancel_heartbeat_task()
+        self._stop_heartbeat()
         await self._close_websocket()
         logger.debug('Disconnected from server')
         await self._emit('client_disconnected')
@@ -188,22 +276,11 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
         with suppress(BaseException):
             await self._ws.close()
 
-    def _create_heartbeat_task(self) -> None:
-        self._heartbeat_task = asyncio.create_task(self._send_heartbeat())
+    def _start_heartbeat(self) -> None:
+        self._heartbeat.add(self._key, self._ws)
 
-    async def _cancel_heartbeat_task(self) -> None:
-        self._heartbeat_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await self._heartbeat_task
-
-    async def _send_heartbeat(self) -> None:
-        data = Frame.encode(WS.OP_HEARTBEAT, b'')
-        while True:
-            try:
-                await self._ws.send_bytes(data)
-            except Exception as exc:
-                logger.error(f'[{self._liverid}] Failed to send heartbeat due to: {repr(exc)}')
-            await asyncio.sleep(self._HEARTBEAT_INTERVAL)
+    def _stop_heartbeat(self) -> None:
+        self._heartbeat.remove(self._key)
 
     async def _create_message_loop(self) -> None:
         self._message_loop_task = asyncio.create_task(self._message_loop())
@@ -211,6 +288,9 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
         logger.debug('Created message loop')
 
     async def _terminate_message_loop(self) -> None:
+        if self._message_loop_task is None:
+            # stopped before it got started
+            return
         self._message_loop_task.cancel()
         with suppress(asyncio.CancelledError):
             await self._message_loop_task
@@ -218,9 +298,10 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
 
     async def _message_loop(self) -> None:
         while True:
-            for msg in await self._receive():
+            msgs = await self._receive()
+            for msg in msgs:
                 msg['liverid'] = self._liverid
-                await self._emit('danmaku_received', msg)
+            await self._emit('danmaku_batch', self._liverid, msgs)
 
     async def _receive(self) -> List[Dict[str, Any]]:
         self._retry_count = 0
@@ -244,15 +325,17 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
                 else:
                     await self._handle_error(ValueError(wsmsg))
 
-    @staticmethod
-    async def _handle_data(data: bytes) -> Optional[List[Dict[str, Any]]]:
-        loop = asyncio.get_running_loop()
-        op, msg = await loop.run_in_executor(None, Frame.decode, data)
+    async def _handle_data(self, data: bytes) -> Optional[List[Dict[str, Any]]]:
+        op, msg = await self._decoder.decode(data)
 
         if op == WS.OP_MESSAGE:
             msg = cast(List[bytes], msg)
-            return [json.loads(m) for m in msg]
+            if self._filter is None:
+                self._filter = CommandFilter.from_listeners(self._listeners)
+            wants = self._filter.wants
+            return [json.loads(m) for m in msg if wants(m)]
         elif op == WS.OP_HEARTBEAT_REPLY:
+            self._heartbeat.on_reply(self._key)
             return None
         else:
             return None
@@ -266,95 +349,19 @@ class DanmakuClient(EventEmitter[DanmakuListener]):
         if self._retry_count < self._MAX_RETRIES:
             if self._retry_delay > 0:
                 logger.debug(
-                    'Retry after {} second{}'.format(
+                    'Retry after {:.1f} second{}'.format(
                         self._retry_delay, 's' if self._retry_delay > 1 else ''
                     )
                 )
                 await asyncio.sleep(self._retry_delay)
             await self.reconnect()
             self._retry_count += 1
-            self._retry_delay += 1
+            self._retry_delay = self._governor.backoff(self._retry_delay)
         else:
+            client_states.states[self._key] = ClientStates.FAILED
             raise aiohttp.WebSocketError(1006, f'[{self._liverid}] Over the maximum of retries')
 
 
-class Frame:
-    HEADER_FORMAT = '>IHHII'
-
-    @staticmethod
-    def encode(op: int, msg: bytes) -> bytes:
-        # body = msg.encode()
-        body = msg
-        header_length = WS.PACKAGE_HEADER_TOTAL_LENGTH
-        packet_length = header_length + len(body)
-        ver = WS.HEADER_DEFAULT_VERSION
-        seq = WS.HEADER_DEFAULT_SEQUENCE
-
-        header = struct.pack(
-            Frame.HEADER_FORMAT,
-            packet_length,
-            header_length,
-            ver,  # protocal version
-            op,  # operation
-            seq,  # sequence id
-        )
-
-        return header + body
-
-    @staticmethod
-    def decode(data: bytes) -> Tuple[int, Union[int, bytes, List[bytes]]]:
-        plen, hlen, ver, op, _ = struct.unpack_from(Frame.HEADER_FORMAT, data, 0)
-        body = data[hlen:]
-
-        if op == WS.OP_MESSAGE:
-            if ver == WS.BODY_PROTOCOL_VERSION_BROTLI:
-                data = brotli.decompress(body)
-
-            msg_list = []
-            offset = 0
-            while offset < len(data):
-                plen, hlen, ver, op, _ = struct.unpack_from(
-                    Frame.HEADER_FORMAT, data, offset
-                )
-                body = data[hlen + offset : plen + offset]
-                # msg = body.decode('utf8')
-                msg = body
-                msg_list.append(msg)
-                offset += plen
-
-            return op, msg_list
-        elif op == WS.OP_HEARTBEAT_REPLY:
-            online_count = cast(int, struct.unpack('>I', body)[0])
-            return op, online_count
-        elif op == WS.OP_CONNECT_SUCCESS:
-            # auth_result = body.decode()
-            auth_result = body
-            return op, auth_result
-        else:
-            raise ValueError(f'Unexpected Operation: {op}')
-
-
-class WS(IntEnum):
-    OP_HEARTBEAT = 2
-    OP_HEARTBEAT_REPLY = 3
-    OP_MESSAGE = 5
-    OP_USER_AUTHENTICATION = 7
-    OP_CONNECT_SUCCESS = 8
-    PACKAGE_HEADER_TOTAL_LENGTH = 16
-    PACKAGE_OFFSET = 0
-    HEADER_OFFSET = 4
-    VERSION_OFFSET = 6
-    OPERATION_OFFSET = 8
-    SEQUENCE_OFFSET = 12
-    BODY_PROTOCOL_VERSION_NORMAL = 0
-    BODY_PROTOCOL_VERSION_BROTLI = 3
-    HEADER_DEFAULT_VERSION = 1
-    HEADER_DEFAULT_OPERATION = 1
-    HEADER_DEFAULT_SEQUENCE = 1
-    AUTH_OK = 0
-    AUTH_TOKEN_ERROR = -101
-
-
 class DanmakuCommand(Enum):
     ACTIVITY_MATCH_GIFT = 'ACTIVITY_MATCH_GIFT'
     ANCHOR_LOT_AWARD = 'ANCHOR_LOT_AWARD'
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Final, Optional
+
+import aiohttp
+
+from .api import WebApi
+from .reconnect import TokenBucket
+
+__all__ = 'DanmuInfoService',
+
+
+logger = logging.getLogger(__name__)
+
+
+class DanmuInfoService:
+    """Per-process `getConf` lookups shared by every `DanmakuClient`.
+
+    Results are cached for `ttl` seconds, concurrent lookups of one room
+    share a single request, and requests are bounded both in concurrency and
+    in rate. Lookups go through a dedicated pooled session which caches DNS.
+    """
+
+    _shared: Optional['DanmuInfoService'] = None
+
+    TTL: Final[float] = 300
+    CONCURRENCY: Final[int] = 8
+    RATE: Final[float] = 20
+    DNS_TTL: Final[int] = 600
+
+    def __init__(
+        self,
+        ttl: float = TTL,
+        concurrency: int = CONCURRENCY,
+        rate: float = RATE,
+        dns_ttl: int = DNS_TTL,
+    ) -> None:
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.dns_ttl = dns_ttl
+        self._sem = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        # room_id -> (expires at, danmu info)
+        self._cache: dict[int, tuple[float, Dict[str, Any]]] = {}
+        self._inflight: dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    @classmethod
+    def shared(cls) -> 'DanmuInfoService':
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    async def get(self, room_id: int, refresh: bool = False) -> Dict[str, Any]:
+        if not refresh and (cached := self._cache.get(room_id)):
+            expires, info = cached
+            if expires > time.time():
+                self.hits += 1
+                return info
+
+        if task := self._inflight.get(room_id):
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.create_task(self._fetch(room_id))
+        self._inflight[room_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(room_id, None))
+        return await asyncio.shield(task)
+
+    def invalidate(self, room_id: int) -> None:
+        self._cache.pop(room_id, None)
+
+    def dump(self) -> list[list[Any]]:
+        """The unexpired part of the cache, for `load` in the next process."""
+        now = time.time()
+        return [
+            [room_id, expires, info]
+            for room_id, (expires, info) in self._cache.items()
+            if expires > now
+        ]
+
+    def load(self, entries: list[list[Any]]) -> None:
+        now = time.time()
+        for room_id, expires, info in entries:
+            if expires > now:
+                self._cache[room_id] = (expires, info)
+
+    async def _fetch(self, room_id: int) -> Dict[str, Any]:
+        async with self._sem:
+            await self._bucket.acquire()
+            try:
+                chat_conf = await WebApi(self._get_session()).get_chat_conf(room_id)
+            except Exception:
+                self.errors += 1
+                raise
+        info = {
+            'token': chat_conf['token'],
+            'host_list': chat_conf['host_server_list'],
+        }
+        self._cache[room_id] = (time.time() + self.ttl, info)
+        return info
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.concurrency,
+                    ttl_dns_cache=self.dns_ttl,
+                    keepalive_timeout=60,
+                )
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'cached': len(self._cache),
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+        }
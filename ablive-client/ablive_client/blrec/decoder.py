@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Final, List, Optional, Tuple
+
+from .frame import Frame
+
+__all__ = 'FrameDecoder',
+
+
+logger = logging.getLogger(__name__)
+
+
+def decode_batch(frames: List[bytes]) -> List[Tuple[int, Any]]:
+    # runs in the executor, must stay picklable for process pools
+    results: List[Tuple[int, Any]] = []
+    for data in frames:
+        try:
+            results.append(Frame.decode(data))
+        except Exception as exc:
+            results.append((-1, exc))
+    return results
+
+
+class FrameDecoder:
+    """Process-wide decode stage shared by every `DanmakuClient`.
+
+    Small frames are decoded inline on the event loop, large ones are
+    collected from all clients and handed to the executor in batches.
+    """
+
+    _shared: Optional['FrameDecoder'] = None
+
+    INLINE_THRESHOLD: Final[int] = 1024
+    BATCH_SIZE: Final[int] = 64
+    BATCH_DELAY: Final[float] = 0.005
+
+    def __init__(
+        self,
+        inline_threshold: int = INLINE_THRESHOLD,
+        batch_size: int = BATCH_SIZE,
+        batch_delay: float = BATCH_DELAY,
+        processes: int = 0,
+    ) -> None:
+        self.inline_threshold = inline_threshold
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._executor: Optional[Executor] = (
+            ProcessPoolExecutor(processes) if processes > 0 else None
+        )
+        self._pending: List[Tuple[bytes, asyncio.Future, float]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+        self._started = time.monotonic()
+        self.frames_inline = 0
+        self.frames_batched = 0
+        self.batches = 0
+        self.bytes_decoded = 0
+        # inline on the loop, batched from submit to the results (executor
+        # wait included)
+        self.decode_seconds_inline = 0.0
+        self.decode_seconds_batched = 0.0
+        self.queue_seconds = 0.0
+
+    @classmethod
+    def shared(cls) -> 'FrameDecoder':
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    async def decode(self, data: bytes) -> Tuple[int, Any]:
+        if len(data) <= self.inline_threshold:
+            t0 = time.perf_counter()
+            result = Frame.decode(data)
+            self.decode_seconds_inline += time.perf_counter() - t0
+            self.frames_inline += 1
+            self.bytes_decoded += len(data)
+            return result
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((data, fut, time.perf_counter()))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_delay, self._flush)
+
+        op, msg = await fut
+        if op == -1:
+            raise msg
+        return op, msg
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[bytes, asyncio.Future, float]]):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        self.queue_seconds += sum(t0 - enqueued for _, _, enqueued in batch)
+        try:
+            results = await loop.run_in_executor(
+                self._executor, decode_batch, [data for data, _, _ in batch]
+            )
+        except Exception as exc:
+            logger.error(f'Failed to decode a batch of frames: {repr(exc)}')
+            results = [(-1, exc)] * len(batch)
+
+        self.decode_seconds_batched += time.perf_counter() - t0
+        self.batches += 1
+        self.frames_batched += len(batch)
+        for (data, fut, _), result in zip(batch, results):
+            self.bytes_decoded += len(data)
+            if not fut.done():
+                fut.set_result(result)
+
+    def stats(self) -> dict[str, Any]:
+        frames = self.frames_inline + self.frames_batched
+        return {
+            'frames': frames,
+            'frames_inline': self.frames_inline,
+            'frames_batched': self.frames_batched,
+            'batches': self.batches,
+            'bytes': self.bytes_decoded,
+            'decode_seconds_inline': self.decode_seconds_inline,
+            'decode_seconds_batched': self.decode_seconds_batched,
+            'queue_seconds': self.queue_seconds,
+            'frames_per_second': frames / (time.monotonic() - self._started),
+            'queue_latency_avg': (
+                self.queue_seconds / self.frames_batched if self.frames_batched else 0.0
+            ),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
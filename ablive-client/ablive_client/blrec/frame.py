@@ -0,0 +1,84 @@
+import struct
+from enum import IntEnum
+from typing import List, Tuple, Union, cast
+
+import brotli
+
+__all__ = 'Frame', 'WS'
+
+
+class Frame:
+    HEADER_FORMAT = '>IHHII'
+
+    @staticmethod
+    def encode(op: int, msg: bytes) -> bytes:
+        # body = msg.encode()
+        body = msg
+        header_length = WS.PACKAGE_HEADER_TOTAL_LENGTH
+        packet_length = header_length + len(body)
+        ver = WS.HEADER_DEFAULT_VERSION
+        seq = WS.HEADER_DEFAULT_SEQUENCE
+
+        header = struct.pack(
+            Frame.HEADER_FORMAT,
+            packet_length,
+            header_length,
+            ver,  # protocal version
+            op,  # operation
+            seq,  # sequence id
+        )
+
+        return header + body
+
+    @staticmethod
+    def decode(data: bytes) -> Tuple[int, Union[int, bytes, List[bytes]]]:
+        plen, hlen, ver, op, _ = struct.unpack_from(Frame.HEADER_FORMAT, data, 0)
+        body = data[hlen:]
+
+        if op == WS.OP_MESSAGE:
+            if ver == WS.BODY_PROTOCOL_VERSION_BROTLI:
+                data = brotli.decompress(body)
+
+            msg_list = []
+            offset = 0
+            while offset < len(data):
+                plen, hlen, ver, op, _ = struct.unpack_from(
+                    Frame.HEADER_FORMAT, data, offset
+                )
+                body = data[hlen + offset : plen + offset]
+                # msg = body.decode('utf8')
+                msg = body
+                msg_list.append(msg)
+                offset += plen
+
+            return op, msg_list
+        elif op == WS.OP_HEARTBEAT_REPLY:
+            online_count = cast(int, struct.unpack('>I', body)[0])
+            return op, online_count
+        elif op == WS.OP_CONNECT_SUCCESS:
+            # auth_result = body.decode()
+            auth_result = body
+            return op, auth_result
+        else:
+            raise ValueError(f'Unexpected Operation: {op}')
+
+
+class WS(IntEnum):
+    OP_HEARTBEAT = 2
+    OP_HEARTBEAT_REPLY = 3
+    OP_MESSAGE = 5
+    OP_USER_AUTHENTICATION = 7
+    OP_CONNECT_SUCCESS = 8
+    PACKAGE_HEADER_TOTAL_LENGTH = 16
+    PACKAGE_OFFSET = 0
+    HEADER_OFFSET = 4
+    VERSION_OFFSET = 6
+    OPERATION_OFFSET = 8
+    SEQUENCE_OFFSET = 12
+    BODY_PROTOCOL_VERSION_NORMAL = 0
+    BODY_PROTOCOL_VERSION_BROTLI = 3
+    HEADER_DEFAULT_VERSION = 1
+    HEADER_DEFAULT_OPERATION = 1
+    HEADER_DEFAULT_SEQUENCE = 1
+    AUTH_OK = 0
+    AUTH_TOKEN_ERROR = -101
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Any, Final, Hashable, Optional
+
+from aiohttp import ClientWebSocketResponse
+
+from .frame import WS, Frame
+
+__all__ = 'HeartbeatWheel',
+
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatWheel:
+    """One heartbeat task for every authenticated websocket of the process.
+
+    Rooms are spread round-robin over `slots` buckets, the wheel visits one
+    bucket every `interval / slots` seconds, so each room still gets a
+    heartbeat per `interval` but the sends never pile up. The clients key
+    their rooms by `(liverid, room_id)`.
+    """
+
+    _shared: Optional['HeartbeatWheel'] = None
+
+    INTERVAL: Final[float] = 30
+    SLOTS: Final[int] = 300
+
+    def __init__(self, interval: float = INTERVAL, slots: int = SLOTS) -> None:
+        self.interval = interval
+        self._data = Frame.encode(WS.OP_HEARTBEAT, b'')
+        self._slots: list[dict[Hashable, ClientWebSocketResponse]] = [
+            {} for _ in range(slots)
+        ]
+        self._where: dict[Hashable, int] = {}
+        self._next_slot = 0
+        self._sent_at: dict[Hashable, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.latency: dict[Hashable, float] = {}
+        self.failures = 0
+
+    @classmethod
+    def shared(cls) -> 'HeartbeatWheel':
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def add(self, key: Hashable, ws: ClientWebSocketResponse) -> None:
+        self.remove(key)
+        index = self._next_slot
+        self._next_slot = (index + 1) % len(self._slots)
+        self._slots[index][key] = ws
+        self._where[key] = index
+
+        # first heartbeat goes out right away as it used to
+        task = asyncio.create_task(self._send(key, ws))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, key: Hashable) -> None:
+        if (index := self._where.pop(key, None)) is not None:
+            del self._slots[index][key]
+        self._sent_at.pop(key, None)
+        self.latency.pop(key, None)
+
+    def on_reply(self, key: Hashable) -> None:
+        if (sent_at := self._sent_at.pop(key, None)) is not None:
+            self.latency[key] = asyncio.get_running_loop().time() - sent_at
+
+    async def _send(self, key: Hashable, ws: ClientWebSocketResponse) -> None:
+        self._sent_at[key] = asyncio.get_running_loop().time()
+        try:
+            await ws.send_bytes(self._data)
+        except Exception as exc:
+            self.failures += 1
+            logger.error(f'[{key}] Failed to send heartbeat due to: {repr(exc)}')
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        tick = self.interval / len(self._slots)
+        deadline = loop.time()
+        index = 0
+        while True:
+            deadline += tick
+            await asyncio.sleep(max(0, deadline - loop.time()))
+            if slot := self._slots[index]:
+                await asyncio.gather(
+                    *(self._send(key, ws) for key, ws in list(slot.items()))
+                )
+            index = (index + 1) % len(self._slots)
+
+    def stats(self) -> dict[str, Any]:
+        latencies = self.latency.values()
+        return {
+            'rooms': len(self._where),
+            'failures': self.failures,
+            'latency_avg': sum(latencies) / len(latencies) if latencies else 0.0,
+            'latency_max': max(latencies, default=0.0),
+        }
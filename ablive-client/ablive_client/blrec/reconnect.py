@@ -0,0 +1,144 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Final, Iterable, Optional
+
+__all__ = 'TokenBucket', 'ReconnectGovernor'
+
+
+class TokenBucket:
+    """Tokens at `rate` per second, up to `burst` saved up.
+
+    Waiters queue in order; one task refills for them and wakes each as
+    its token comes, instead of every waiter polling on its own.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._waiters: deque[asyncio.Future] = deque()
+        self._waker: Optional[asyncio.Task] = None
+        self.waiting = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        if self._waker is None or self._waker.done():
+            self._waker = asyncio.create_task(self._wake())
+        self.waiting += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # woken and cancelled at once, the token goes back
+                self._tokens += 1
+            raise
+        finally:
+            self.waiting -= 1
+
+    async def _wake(self) -> None:
+        waiters = self._waiters
+        while waiters:
+            self._refill()
+            while waiters and (waiters[0].done() or self._tokens >= 1):
+                fut = waiters.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    self._tokens -= 1
+            if waiters:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ReconnectGovernor:
+    """Process-wide gate every `DanmakuClient` passes before connecting.
+
+    Connection attempts draw from a shared token bucket, back off with
+    decorrelated jitter and avoid hosts whose circuit breaker is open.
+    """
+
+    _shared: Optional['ReconnectGovernor'] = None
+
+    RATE: Final[float] = 20
+    BURST: Final[float] = 50
+    BACKOFF_BASE: Final[float] = 0.5
+    BACKOFF_CAP: Final[float] = 30
+    FAILURE_THRESHOLD: Final[int] = 5
+    COOLDOWN: Final[float] = 30
+
+    def __init__(
+        self,
+        rate: float = RATE,
+        burst: float = BURST,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_cap: float = BACKOFF_CAP,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        cooldown: float = COOLDOWN,
+    ) -> None:
+        self._bucket = TokenBucket(rate, burst)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        # host -> [consecutive failures, open until]
+        self._breakers: dict[str, list[float]] = {}
+        self.attempts = 0
+        self.failures = 0
+
+    @classmethod
+    def shared(cls) -> 'ReconnectGovernor':
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    async def acquire(self) -> None:
+        await self._bucket.acquire()
+        self.attempts += 1
+
+    def backoff(self, prev: float) -> float:
+        # "decorrelated jitter", the next delay is drawn from [base, prev * 3]
+        upper = max(self.backoff_base, prev * 3)
+        return min(self.backoff_cap, random.uniform(self.backoff_base, upper))
+
+    def available(self, host: str) -> bool:
+        breaker = self._breakers.get(host)
+        return breaker is None or breaker[1] <= time.monotonic()
+
+    def retry_after(self, hosts: Iterable[str]) -> float:
+        now = time.monotonic()
+        return max(0.0, min(
+            (self._breakers[h][1] - now for h in hosts if h in self._breakers),
+            default=0.0,
+        ))
+
+    def record_success(self, host: str) -> None:
+        self._breakers.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        self.failures += 1
+        breaker = self._breakers.setdefault(host, [0, 0.0])
+        breaker[0] += 1
+        if breaker[0] >= self.failure_threshold:
+            # half-open after the cooldown, one more failure opens it again
+            breaker[0] = self.failure_threshold - 1
+            breaker[1] = time.monotonic() + self.cooldown
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'queue_depth': self._bucket.waiting,
+            'attempts': self.attempts,
+            'failures': self.failures,
+            'open_circuits': sum(1 for b in self._breakers.values() if b[1] > now),
+        }
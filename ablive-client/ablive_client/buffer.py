@@ -0,0 +1,285 @@
+# Used by packer.Packer only
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Final, Optional
+
+import orjson as json
+
+from .spool import Acks, Cursor, Spool
+
+
+class RowBuffer:
+    """Rows waiting for a `Storer`, bounded by `maxsize` (0 is unbounded).
+
+    What happens to rows past the limit depends on `policy`:
+      - pause: rows are still taken but `wait_writable` blocks until the
+        buffer drains, which stops the clients from reading their websockets
+      - drop: rows are discarded and counted
+      - spill: rows go to a file under `spill_dir` and are read back as the
+        buffer drains
+
+    With a `spool`, every row is logged to disk on the way in and only
+    forgotten once `ack`ed, see `Spool`. Rows past the limit then live in
+    the spool alone, unless the policy is drop, and are read back from it
+    as the buffer drains, so an outage costs disk rather than memory.
+    """
+
+    PAUSE: Final = 'pause'
+    DROP: Final = 'drop'
+    SPILL: Final = 'spill'
+    # rows read back from the spool at a time when unbounded
+    READ_ROWS: Final = 10000
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 0,
+        policy: str = PAUSE,
+        spill_dir: str = 'spill',
+        spool: Optional[Spool] = None,
+    ) -> None:
+        if policy not in (self.PAUSE, self.DROP, self.SPILL):
+            raise ValueError(f'unknown buffer policy: {policy}')
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self._rows: deque[dict[str, Any]] = deque()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self.spool = spool
+        # [segment, count] runs of the rows in memory, in order
+        self._runs: deque[list[int]] = deque()
+        # rows in the spool only, from `_cursor` on
+        self._spooled = 0
+        self._cursor: Optional[Cursor] = None
+
+        # set once `flush_rows` or `flush_bytes` is reached, see `Storer`
+        self.flush_rows = 0
+        self.flush_bytes = 0
+        self._ready = asyncio.Event()
+        self.nbytes = 0
+        self._first_put = 0.0
+
+        self._spill_path = os.path.join(spill_dir, f'{name}-{os.getpid()}.spill')
+        self._spill_file: Optional[Any] = None
+        self._spill_offset = 0
+        self._spilled = 0
+        if policy == self.SPILL:
+            os.makedirs(spill_dir, exist_ok=True)
+            # spilled rows don't outlive the process
+            self._spill_file = open(self._spill_path, 'w+b')
+
+        self.high_water = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def qsize(self) -> int:
+        return len(self._rows) + self._spilled + self._spooled
+
+    @property
+    def paused(self) -> bool:
+        return not self._writable.is_set()
+
+    def put_nowait(self, row: dict[str, Any]) -> None:
+        if self._full() and self.policy == self.DROP:
+            self.dropped += 1
+            return
+        if self.spool is None:
+            self._put(row)
+        elif self._spooled or self._full():
+            # behind the rows still on disk, to keep the order
+            if not self._spooled:
+                self._cursor = self.spool.tell()
+            self.spool.append(row)
+            self._spooled += 1
+        else:
+            self._track(self.spool.append(row), 1)
+            self._put(row)
+
+    def replay(self) -> int:
+        """Queue the rows the spool kept from the previous run, only as
+        many are read as fit, the rest as the buffer drains."""
+        if self.spool is None:
+            return 0
+        leftovers = list(self.spool.replay())
+        if not leftovers:
+            return 0
+        n = sum(count for _, count in leftovers)
+        if not self._spooled:
+            self._cursor = (leftovers[0][0], 0)
+        self._spooled += n
+        self._unspool()
+        self._check_ready()
+        return n
+
+    def _full(self) -> bool:
+        return bool(self.maxsize) and self.qsize() >= self.maxsize
+
+    def _track(self, seg: int, count: int) -> None:
+        runs = self._runs
+        if runs and runs[-1][0] == seg:
+            runs[-1][1] += count
+        else:
+            runs.append([seg, count])
+
+    def _put(self, row: dict[str, Any]) -> None:
+        if self._full():
+            if self.policy == self.SPILL:
+                self._spill(row)
+                return
+            self._writable.clear()
+
+        if not self._rows:
+            self._first_put = time.monotonic()
+        self._rows.append(row)
+        if len(self._rows) > self.high_water:
+            self.high_water = len(self._rows)
+        self.nbytes += _row_size(row)
+        self._check_ready()
+
+    def drain(self, max_rows: int = 0) -> tuple[list[dict[str, Any]], Acks]:
+        """Take up to `max_rows` rows, with what to `ack` once they are
+        stored."""
+        rows = self._rows
+        if max_rows and max_rows < len(rows):
+            self.nbytes -= self.nbytes * max_rows // len(rows)
+            batch = [rows.popleft() for _ in range(max_rows)]
+        else:
+            self.nbytes = 0
+            batch = list(rows)
+            rows.clear()
+        acks = self._take_acks(len(batch))
+        self._unspill()
+        self._unspool()
+        self._check_ready()
+        self._check_writable()
+        return batch, acks
+
+    def ack(self, acks: Acks) -> None:
+        if self.spool is not None:
+            self.spool.ack(acks)
+
+    def requeue(self, rows: list[dict[str, Any]], acks: Acks) -> None:
+        """Put a drained batch back at the front, e.g. after a failed
+        insert."""
+        self._rows.extendleft(reversed(rows))
+        for seg, count in reversed(acks.items()):
+            self._runs.appendleft([seg, count])
+        self.nbytes += sum(map(_row_size, rows))
+        # counts as fresh so a flush isn't retried right away
+        self._first_put = time.monotonic()
+        if self._full() and self.policy == self.PAUSE and self.spool is None:
+            self._writable.clear()
+        self._check_ready()
+
+    def _take_acks(self, n: int) -> Acks:
+        acks: Acks = {}
+        runs = self._runs
+        while n and runs:
+            run = runs[0]
+            k = min(n, run[1])
+            acks[run[0]] = acks.get(run[0], 0) + k
+            run[1] -= k
+            n -= k
+            if not run[1]:
+                runs.popleft()
+        return acks
+
+    def age(self) -> float:
+        """Seconds since the oldest row in memory came in, 0 when empty."""
+        return time.monotonic() - self._first_put if self._rows else 0.0
+
+    async def wait_ready(self) -> None:
+        await self._ready.wait()
+
+    async def wait_writable(self) -> None:
+        await self._writable.wait()
+
+    def _check_ready(self) -> None:
+        if (self.flush_rows and len(self._rows) >= self.flush_rows) or (
+            self.flush_bytes and self.nbytes >= self.flush_bytes
+        ):
+            self._ready.set()
+        else:
+            self._ready.clear()
+
+    def _check_writable(self) -> None:
+        if not self.maxsize or self.qsize() < self.maxsize:
+            self._writable.set()
+
+    def _spill(self, row: dict[str, Any]) -> None:
+        assert self._spill_file is not None
+        self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(json.dumps(row) + b'\n')
+        self._spilled += 1
+        self.spilled += 1
+
+    def _unspill(self) -> None:
+        if not self._spilled or self._spill_file is None:
+            return
+        room = (self.maxsize - len(self._rows)) if self.maxsize else self._spilled
+        f = self._spill_file
+        f.flush()
+        f.seek(self._spill_offset)
+        if not self._rows:
+            self._first_put = time.monotonic()
+        for _ in range(min(room, self._spilled)):
+            row = json.loads(f.readline())
+            self._rows.append(row)
+            self.nbytes += _row_size(row)
+            self._spilled -= 1
+        self._spill_offset = f.tell()
+        if not self._spilled:
+            f.seek(0)
+            f.truncate()
+            self._spill_offset = 0
+
+    def _unspool(self) -> None:
+        if not self._spooled:
+            return
+        assert self.spool is not None and self._cursor is not None
+        room = (self.maxsize - len(self._rows)) if self.maxsize else self.READ_ROWS
+        if room <= 0:
+            return
+        want = min(room, self._spooled)
+        rows, runs, self._cursor = self.spool.read(self._cursor, want)
+        # short only once it reached the end, less any broken lines
+        self._spooled = self._spooled - len(rows) if len(rows) == want else 0
+        if not self._spooled:
+            self._cursor = None
+        if not rows:
+            return
+        if not self._rows:
+            self._first_put = time.monotonic()
+        for seg, count in runs:
+            self._track(seg, count)
+        self._rows.extend(rows)
+        self.nbytes += sum(map(_row_size, rows))
+        if len(self._rows) > self.high_water:
+            self.high_water = len(self._rows)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'depth': self.qsize(),
+            'bytes': self.nbytes,
+            'high_water': self.high_water,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'paused': self.paused,
+            **({'spool': self.spool.stats()} if self.spool is not None else {}),
+        }
+
+    def close(self) -> None:
+        if self.spool is not None:
+            self.spool.close()
+        if self._spill_file is not None:
+            self._spill_file.close()
+            os.remove(self._spill_path)
+
+
+def _row_size(row: dict[str, Any]) -> int:
+    # rough wire size, text dominates
+    return sum(len(v) if isinstance(v, str) else 8 for v in row.values())
@@ -0,0 +1,105 @@
+# Used by storer.Storer only
+
+import os
+import tempfile
+from typing import Any, Sequence
+
+import sqlalchemy as sa
+
+EXECUTE_MANY = 'execute_many'
+MULTIROW = 'multirow'
+LOAD_DATA = 'load_data'
+
+STRATEGIES = (EXECUTE_MANY, MULTIROW, LOAD_DATA)
+
+
+def insert_columns(table: sa.Table) -> list[str]:
+    auto = table.autoincrement_column
+    return [c.name for c in table.columns if c is not auto]
+
+
+def _quote(name: str) -> str:
+    return '`%s`' % name.replace('`', '``')
+
+
+def _qualified(table: sa.Table) -> str:
+    if table.schema:
+        return f'{_quote(table.schema)}.{_quote(table.name)}'
+    return _quote(table.name)
+
+
+def _chunks(rows: Sequence[Any], size: int):
+    for i in range(0, len(rows), size):
+        yield rows[i : i + size]
+
+
+async def insert_multirow(
+    conn: Any,
+    table: sa.Table,
+    rows: Sequence[dict[str, Any]],
+    chunk_size: int,
+    on_duplicate: str = '',
+) -> None:
+    """`INSERT INTO t (...) VALUES (...), (...), ...` with `chunk_size` rows
+    per statement, on a raw asyncmy connection.
+
+    `on_duplicate` is appended as `ON DUPLICATE KEY UPDATE ...` if given.
+    """
+    columns = insert_columns(table)
+    head = 'INSERT INTO %s (%s) VALUES ' % (
+        _qualified(table), ', '.join(map(_quote, columns))
+    )
+    placeholder = '(%s)' % ', '.join(['%s'] * len(columns))
+    tail = f' ON DUPLICATE KEY UPDATE {on_duplicate}' if on_duplicate else ''
+
+    async with conn.cursor() as cursor:
+        for chunk in _chunks(rows, chunk_size):
+            sql = head + ', '.join([placeholder] * len(chunk)) + tail
+            args = [row[c] for row in chunk for c in columns]
+            await cursor.execute(sql, args)
+
+
+def _tsv_field(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return (
+            value.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+        )
+    return str(value)
+
+
+async def insert_load_data(
+    conn: Any,
+    table: sa.Table,
+    rows: Sequence[dict[str, Any]],
+    chunk_size: int,
+) -> None:
+    """`LOAD DATA LOCAL INFILE` from a temporary TSV file per chunk.
+
+    Needs `local_infile` on both the server and the connection, see
+    `Storer`.
+    """
+    columns = insert_columns(table)
+    sql_tail = (
+        " INTO TABLE %s CHARACTER SET utf8mb4"
+        " FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'"
+        " LINES TERMINATED BY '\\n' (%s)"
+    ) % (_qualified(table), ', '.join(map(_quote, columns)))
+
+    async with conn.cursor() as cursor:
+        for chunk in _chunks(rows, chunk_size):
+            fd, path = tempfile.mkstemp(suffix='.tsv')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+                    for row in chunk:
+                        f.write('\t'.join([_tsv_field(row[c]) for c in columns]))
+                        f.write('\n')
+                await cursor.execute(
+                    "LOAD DATA LOCAL INFILE %s" + sql_tail, (path,)
+                )
+            finally:
+                os.remove(path)
@@ -9,4 +9,53 @@ class Settings(BaseSettings):
     server_api_key: str
     machine_id: str
     add_room_interval: float
-    packer1_mysql_dsn: str  # MysqlDsn
+    onboard_concurrency: int = 50  # rooms connecting at once
+    snapshot_dir: str = 'snapshot'  # empty to always start afresh
+    snapshot_max_age: float = 600
+    handoff_wait: float = 90  # for a cutover before keeping a room's events
+    worker_ready_timeout: float = 90  # the most a worker holds up the next
+    worker_restart_backoff_cap: float = 60
+    # >0 moves the sinks into this many writer processes
+    writers_num: int = 0
+    writer_host: str = '127.0.0.1'
+    writer_port: int = 7460  # the first writer, the others count up
+    packer1_mysql_dsn: str = ''  # MysqlDsn, without a schema
+    mysql_pool_size: int = 4  # per process, shared by all schemas
+    decode_processes: int = 0
+    decode_inline_threshold: int = 1024
+    reconnect_rate: float = 20
+    reconnect_burst: int = 50
+    danmu_info_ttl: float = 300
+    danmu_info_concurrency: int = 8
+    danmu_info_rate: float = 20
+    buffer_maxsize: int = 500000
+    buffer_policies: dict[str, str] = {'ablive_en': 'drop'}
+    spill_dir: str = 'spill'
+    spool_dir: str = 'spool'  # empty to turn the spool off
+    spool_segment_bytes: int = 16 << 20
+    spool_segment_seconds: float = 10
+    spool_fsync_interval: float = 0.2
+    insert_strategy: str = 'execute_many'  # or 'multirow', 'load_data'
+    insert_chunk_size: int = 1000
+    flush_rows: int = 5000
+    flush_bytes: int = 4 << 20
+    flush_max_age: float = 5
+    max_inflight_flushes: int = 2
+    sinks: list[str] = ['mysql']  # and/or 'parquet'
+    parquet_dir: str = 'parquet'
+    parquet_period: str = 'day'  # or 'hour'
+    parquet_row_group_rows: int = 100000
+    parquet_file_max_rows: int = 1000000
+    parquet_file_max_age: float = 600
+    dedup_window: float = 600  # 0 to turn deduplication off
+    dedup_max_keys: int = 2000000
+    normalize_unames: bool = False
+    uname_schema: str = 'ablive_uname'
+    uname_cache_size: int = 500000
+    rollup: bool = False
+    rollup_schema: str = 'ablive_rollup'
+    rollup_grace: float = 90
+    # >0 serves /metrics, process i on metrics_port + i
+    metrics_port: int = 0
+    metrics_host: str = '127.0.0.1'
+    metrics_top_rooms: int = 50  # rooms with their own label
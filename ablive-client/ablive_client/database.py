@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+import databases
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """One MySQL pool per process, shared by every `Storer`.
+
+    The DSN carries no schema; tables are schema-qualified instead, so the
+    same connections serve all of them. `pool_size` caps the connections a
+    process holds, whatever number of schemas it writes.
+    """
+
+    def __init__(
+        self,
+        mysql_dsn: str,
+        pool_size: int = 4,
+        **options: Any,
+    ) -> None:
+        self.pool_size = pool_size
+        self._db = databases.Database(
+            mysql_dsn, min_size=1, max_size=pool_size, **options
+        )
+        self._connect_lock = asyncio.Lock()
+        self.in_use = 0
+        self.acquires = 0
+        # seconds spent waiting for a free connection
+        self.wait = Histogram((0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+    async def connect(self) -> None:
+        async with self._connect_lock:
+            if not self._db.is_connected:
+                await self._db.connect()
+
+    async def disconnect(self) -> None:
+        async with self._connect_lock:
+            if self._db.is_connected:
+                await self._db.disconnect()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[databases.core.Connection]:
+        t0 = time.perf_counter()
+        async with self._db.connection() as conn:
+            self.wait.observe(time.perf_counter() - t0)
+            self.acquires += 1
+            self.in_use += 1
+            try:
+                yield conn
+            finally:
+                self.in_use -= 1
+
+    async def execute(self, query: Any) -> Any:
+        async with self.connection() as conn:
+            return await conn.execute(query)
+
+    async def execute_many(self, query: Any, values: list) -> None:
+        async with self.connection() as conn:
+            await conn.execute_many(query, values)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'pool_size': self.pool_size,
+            'in_use': self.in_use,
+            'utilization': self.in_use / self.pool_size,
+            'acquires': self.acquires,
+            'wait': self.wait.cumulative(),
+            'wait_avg': self.wait.sum / self.wait.count if self.wait.count else 0.0,
+        }
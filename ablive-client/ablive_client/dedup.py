@@ -0,0 +1,79 @@
+# Used by packer.Packer only
+
+import time
+from collections import Counter, deque
+from typing import Any, Mapping, Sequence
+
+from .blrec import Danmaku
+from .events import Extractor
+
+
+class Deduplicator:
+    """Drops events already seen within the last `window` seconds.
+
+    Keys are hashed and kept in `buckets` sets covering `window / buckets`
+    seconds each; the oldest set is let go as time moves on, or early once
+    the sets hold `max_keys` keys together, which bounds the memory.
+    """
+
+    def __init__(
+        self,
+        keys: Mapping[str, Sequence[Extractor]],
+        window: float = 600,
+        buckets: int = 10,
+        max_keys: int = 2000000,
+    ) -> None:
+        self._keys = dict(keys)
+        self.span = window / buckets
+        self.max_bucket_keys = max(1, max_keys // buckets)
+        self._buckets: deque[set[int]] = deque(
+            (set() for _ in range(buckets)), maxlen=buckets
+        )
+        self._rotated_at = time.monotonic()
+        self.checked: Counter[str] = Counter()
+        self.dropped: Counter[str] = Counter()
+        self.unkeyed = 0
+
+    def seen(self, liverid: int, msg: Danmaku) -> bool:
+        """Whether `msg` is a copy, remembering it if not."""
+        cmd = msg['cmd']
+        if (getters := self._keys.get(cmd)) is None:
+            cmd = cmd.partition(':')[0]
+            if (getters := self._keys.get(cmd)) is None:
+                return False
+        try:
+            key = hash((cmd, liverid, *[getter(msg) for getter in getters]))
+        except (KeyError, IndexError, TypeError):
+            self.unkeyed += 1
+            return False
+
+        self.checked[cmd] += 1
+        current = self._current()
+        for bucket in self._buckets:
+            if key in bucket:
+                self.dropped[cmd] += 1
+                return True
+        current.add(key)
+        return False
+
+    def _current(self) -> set[int]:
+        buckets = self._buckets
+        elapsed = int((time.monotonic() - self._rotated_at) / self.span)
+        if elapsed:
+            self._rotated_at += elapsed * self.span
+            for _ in range(min(elapsed, len(buckets))):
+                buckets.append(set())
+        elif len(buckets[-1]) >= self.max_bucket_keys:
+            buckets.append(set())
+        return buckets[-1]
+
+    def stats(self) -> dict[str, Any]:
+        checked = sum(self.checked.values())
+        dropped = sum(self.dropped.values())
+        return {
+            'keys': sum(map(len, self._buckets)),
+            'checked': dict(self.checked),
+            'dropped': dict(self.dropped),
+            'unkeyed': self.unkeyed,
+            'hit_rate': dropped / checked if checked else 0.0,
+        }
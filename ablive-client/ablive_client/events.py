@@ -0,0 +1,260 @@
+# Used by packer.Packer only
+
+from typing import Any, Callable, Mapping, NamedTuple, Optional, Sequence
+
+from .blrec import Danmaku, DanmakuCommand
+
+Extractor = Callable[[Danmaku], Any]
+Emit = Callable[[str, dict[str, Any]], None]
+
+
+class path(tuple):
+    """A field path such as `path('data', 'uid')`, inlined when compiled."""
+
+    def __new__(cls, *keys: Any) -> 'path':
+        return super().__new__(cls, keys)
+
+    def __call__(self, msg: Danmaku) -> Any:
+        for key in self:
+            msg = msg[key]
+        return msg
+
+
+class const:
+    """A constant field value, inlined when compiled."""
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def __call__(self, msg: Danmaku) -> Any:
+        return self.value
+
+
+class Route(NamedTuple):
+    table: str
+    fields: tuple[tuple[str, Extractor], ...]
+    when: Optional[Extractor] = None
+
+
+def route(table: str, when: Optional[Extractor] = None, **fields: Extractor) -> Route:
+    return Route(table, tuple(fields.items()), when)
+
+
+def compile_routes(routes: Sequence[Route]) -> Callable[[Danmaku, int, Emit], None]:
+    """Turn the routes of one command into a single function.
+
+    Field paths become plain subscriptions off a local for their top-level
+    key and every row is a dict display, the way a hand-written handler
+    reads, so a message costs one call instead of one per field.
+    """
+    env: dict[str, Any] = {}
+    getters = [getter for _, fields, when in routes for _, getter in fields]
+    getters += [when for _, _, when in routes if when is not None]
+    # top-level keys read more than once get a local
+    tops = [g[0] for g in getters if isinstance(g, path) and len(g) > 1]
+    locals_ = {key: f'_m{i}' for i, key in enumerate(dict.fromkeys(tops))
+               if tops.count(key) > 1}
+
+    def expr(getter: Extractor) -> str:
+        if isinstance(getter, path):
+            if getter[0] in locals_ and len(getter) > 1:
+                base, keys = locals_[getter[0]], getter[1:]
+            else:
+                base, keys = 'msg', getter
+            return base + ''.join(f'[{key!r}]' for key in keys)
+        if isinstance(getter, const):
+            return repr(getter.value)
+        name = f'_f{len(env)}'
+        env[name] = getter
+        return f'{name}(msg)'
+
+    lines = ['def build(msg, liverid, emit):']
+    lines += [f'    {name} = msg[{key!r}]' for key, name in locals_.items()]
+    for table, fields, when in routes:
+        indent = '    '
+        if when is not None:
+            lines.append(f'    if {expr(when)}:')
+            indent += '    '
+        items = ''.join(f'{name!r}: {expr(getter)}, ' for name, getter in fields)
+        lines.append(f"{indent}emit({table!r}, {{{items}'liverid': liverid}})")
+    lines.append('    return')
+
+    exec('\n'.join(lines), env)
+    return env['build']
+
+
+class Dispatcher:
+    """Maps a `cmd` to the rows it produces.
+
+    Commands are looked up exactly first, then by the part before `:` for
+    variants like `DANMU_MSG:4:0:2:2:2:0`. Resolved variants are remembered.
+    """
+
+    MAX_VARIANTS = 1024
+
+    def __init__(self, routes: Mapping[str, Sequence[Route]]) -> None:
+        self._builders = {cmd: compile_routes(rs) for cmd, rs in routes.items()}
+        self._commands = frozenset(self._builders)
+
+    @property
+    def commands(self) -> frozenset[str]:
+        return self._commands
+
+    def dispatch(self, liverid: int, danmu: Danmaku, emit: Emit) -> None:
+        cmd = danmu['cmd']
+        if (build := self._builders.get(cmd)) is None:
+            build = self._resolve(cmd)
+        build(danmu, liverid, emit)
+
+    def _resolve(self, cmd: str) -> Callable[[Danmaku, int, Emit], None]:
+        build = self._builders.get(cmd.partition(':')[0], _skip)
+        if len(self._builders) < len(self._commands) + self.MAX_VARIANTS:
+            self._builders[cmd] = build
+        return build
+
+
+def _skip(msg: Danmaku, liverid: int, emit: Emit) -> None:
+    return
+
+
+def _danmu_text(msg: Danmaku) -> str:
+    info = msg['info']
+    # emoticon danmaku
+    if isinstance(info[0][13], dict):
+        return f'[{info[1]}]'
+    return info[1]
+
+
+def _gift_info(msg: Danmaku) -> str:
+    data = msg['data']
+    gift_info = f'{data["giftName"]}x{data["num"]}'
+    # 记录盲盒内容, e.g. '[紫金宝盒]玫瑰x4'
+    if data['blind_gift']:
+        gift_info = '[%s]%s' % (data['blind_gift']['original_gift_name'], gift_info)
+    return gift_info
+
+
+def _gift_cost(msg: Danmaku) -> float:
+    data = msg['data']
+    if data['blind_gift']:
+        return data['total_coin'] / 1000
+    return (data['discount_price'] * data['num']) / 1000
+
+
+_data_uid = path('data', 'uid')
+_sc_price = path('data', 'price')
+
+
+EVENT_ROUTES: dict[str, Sequence[Route]] = {
+    DanmakuCommand.DANMU_MSG.value: (
+        route(
+            'ablive_dm',
+            # ts=lambda msg: msg['info'][0][4] // 1000,
+            ts=path('info', 9, 'ts'),
+            uid=path('info', 2, 0),
+            uname=path('info', 2, 1),
+            text=_danmu_text,
+        ),
+    ),
+    DanmakuCommand.INTERACT_WORD.value: (
+        route(
+            'ablive_en',
+            ts=path('data', 'timestamp'),
+            uid=_data_uid,
+            uname=path('data', 'uname'),
+        ),
+    ),
+    # DanmakuCommand.ENTRY_EFFECT.value: (
+    #     route(
+    #         'ablive_en',
+    #         ts=lambda msg: int(msg['data']['trigger_time'] / 1000000000),
+    #         uid=_data_uid,
+    #         uname=lambda msg: '[欢迎舰长]%s' % (
+    #             msg['data']['copy_writing_v2'].split('%')[1]
+    #         ),
+    #     ),
+    # ),
+    DanmakuCommand.SEND_GIFT.value: (
+        route(
+            'ablive_gf',
+            # 不储存免费礼物
+            when=path('data', 'discount_price'),
+            ts=path('data', 'timestamp'),
+            uid=_data_uid,
+            uname=path('data', 'uname'),
+            gift_info=_gift_info,
+            gift_cost=_gift_cost,
+        ),
+    ),
+    DanmakuCommand.USER_TOAST_MSG.value: (
+        route(
+            'ablive_gf',
+            ts=path('data', 'start_time'),
+            uid=_data_uid,
+            uname=path('data', 'username'),
+            gift_info=lambda msg: (
+                '[大航海]' + msg['data']['toast_msg'].split('，')[-1]
+            ),
+            gift_cost=lambda msg: msg['data']['price'] / 1000,
+        ),
+    ),
+    DanmakuCommand.SUPER_CHAT_MESSAGE.value: (
+        route(
+            'ablive_dm',
+            ts=path('data', 'ts'),
+            uid=_data_uid,
+            uname=path('data', 'user_info', 'uname'),
+            text=lambda msg: '[%ssc] %s' % (
+                msg['data']['price'], msg['data']['message'],
+            ),
+        ),
+        route(
+            'ablive_gf',
+            ts=path('data', 'ts'),
+            uid=_data_uid,
+            uname=path('data', 'user_info', 'uname'),
+            gift_info=const('[SuperChat]'),
+            gift_cost=_sc_price,
+        ),
+        route(
+            'ablive_sc',
+            ts=path('data', 'ts'),
+            uid=_data_uid,
+            uname=path('data', 'user_info', 'uname'),
+            text=path('data', 'message'),
+            sc_price=_sc_price,
+        ),
+    ),
+    DanmakuCommand.USER_VIRTUAL_MVP.value: (
+        route(
+            'ablive_gf',
+            ts=path('data', 'timestamp'),
+            uid=_data_uid,
+            uname=path('data', 'uname'),
+            gift_info=lambda msg: '[MVP]%s%sx%s' % (
+                msg['data']['action'],
+                msg['data']['goods_name'],
+                msg['data']['goods_num'],
+            ),
+            gift_cost=lambda msg: msg['data']['goods_price'] / 1000,
+        ),
+    ),
+}
+
+
+# fields that tell one event from another, so a copy delivered again after a
+# reconnect has the same key, see dedup.Deduplicator
+DEDUP_KEYS: dict[str, tuple[Extractor, ...]] = {
+    # send time in ms, sender and text
+    DanmakuCommand.DANMU_MSG.value: (
+        path('info', 0, 4), path('info', 2, 0), path('info', 1),
+    ),
+    DanmakuCommand.INTERACT_WORD.value: (
+        path('data', 'trigger_time'), _data_uid, path('data', 'msg_type'),
+    ),
+    DanmakuCommand.SEND_GIFT.value: (path('data', 'tid'),),
+    DanmakuCommand.USER_TOAST_MSG.value: (path('data', 'payflow_id'),),
+    DanmakuCommand.SUPER_CHAT_MESSAGE.value: (path('data', 'id'),),
+    # USER_VIRTUAL_MVP carries no order id, two equal purchases within a
+    # second can't be told from a copy, so it is not deduplicated
+}
@@ -0,0 +1,294 @@
+# Used by main.py only
+
+import logging
+from typing import TYPE_CHECKING, Any, Optional
+
+from aiohttp import web
+
+from .blrec import (
+    Danmaku,
+    DanmakuListener,
+    client_states,
+    command_stats,
+)
+from .metrics import Histogram, LoopLagMonitor, SpaceSaving
+
+if TYPE_CHECKING:
+    from .packer import Packer
+    from .remote import RowServer
+    from .rooms_worker import RoomsWorker
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _labels(labels: Optional[dict[str, Any]]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            k,
+            str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'),
+        )
+        for k, v in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+class Exposition:
+    """Samples in the Prometheus text format, grouped by metric name."""
+
+    def __init__(self) -> None:
+        # name -> (type, help, sample lines)
+        self._families: dict[str, tuple[str, str, list[str]]] = {}
+
+    def _family(self, name: str, kind: str, help: str) -> list[str]:
+        if (family := self._families.get(name)) is None:
+            family = self._families[name] = (kind, help, [])
+        return family[2]
+
+    def gauge(
+        self, name: str, value: float, help: str = '',
+        labels: Optional[dict[str, Any]] = None,
+    ) -> None:
+        self._family(name, 'gauge', help).append(
+            f'{name}{_labels(labels)} {_value(value)}'
+        )
+
+    def counter(
+        self, name: str, value: float, help: str = '',
+        labels: Optional[dict[str, Any]] = None,
+    ) -> None:
+        name += '_total'
+        self._family(name, 'counter', help).append(
+            f'{name}{_labels(labels)} {_value(value)}'
+        )
+
+    def histogram(
+        self, name: str, histogram: Histogram, help: str = '',
+        labels: Optional[dict[str, Any]] = None,
+    ) -> None:
+        lines = self._family(name, 'histogram', help)
+        labels = labels or {}
+        for bound, count in histogram.cumulative():
+            lines.append(
+                f'{name}_bucket{_labels({**labels, "le": _value(bound)})} {count}'
+            )
+        lines.append(f'{name}_sum{_labels(labels)} {_value(histogram.sum)}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+    def render(self) -> str:
+        out = []
+        for name, (kind, help, lines) in self._families.items():
+            if help:
+                out.append(f'# HELP {name} {help}')
+            out.append(f'# TYPE {name} {kind}')
+            out.extend(lines)
+        out.append('')
+        return '\n'.join(out)
+
+
+class RoomCounter(DanmakuListener):
+    """Messages per room, only the `top` busiest rooms get a label.
+
+    Space-Saving keeps the label set and the memory bounded however many
+    rooms a process holds. A labelled room shows only what it surely had
+    since it got its slot, its count less the inherited error, so it grows
+    like a counter and starts afresh when a room gets a slot back. The rest
+    is summed up under `liverid="other"`.
+    """
+
+    # counts what the other listeners have parsed, never widens the filter
+    commands = frozenset()
+
+    def __init__(self, top: int = 50) -> None:
+        self.messages = SpaceSaving(top)
+
+    async def on_danmaku_received(self, danmu: Danmaku) -> None:
+        self.messages.add(danmu['liverid'])
+
+    async def on_danmaku_batch(self, liverid: int, danmus: list[Danmaku]) -> None:
+        self.messages.add(liverid, len(danmus))
+
+    def collect(self, exp: Exposition) -> None:
+        help = 'Messages parsed per room, the busiest rooms only'
+        listed = 0
+        for liverid, count, error in self.messages.top():
+            exp.counter(
+                'ablive_room_messages', count - error, help, {'liverid': liverid}
+            )
+            listed += count - error
+        exp.counter(
+            'ablive_room_messages', self.messages.total - listed, help,
+            {'liverid': 'other'},
+        )
+
+
+class MetricsServer:
+    """Serves `/metrics` of this process for Prometheus to scrape.
+
+    Everything is read from the components' counters at scrape time, the
+    hot paths only ever bump those.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        lag: LoopLagMonitor,
+        rooms_worker: Optional['RoomsWorker'] = None,
+        room_counter: Optional[RoomCounter] = None,
+        packer: Optional['Packer'] = None,
+        row_server: Optional['RowServer'] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.lag = lag
+        self.rooms_worker = rooms_worker
+        self.room_counter = room_counter
+        self.packer = packer
+        self.row_server = row_server
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f'metrics on http://{self.host}:{self.port}/metrics')
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.render().encode(), headers={'Content-Type': CONTENT_TYPE}
+        )
+
+    def render(self) -> str:
+        exp = Exposition()
+        self._collect_loop(exp)
+        if self.rooms_worker is not None:
+            self._collect_rooms(exp, self.rooms_worker)
+        if self.room_counter is not None:
+            self.room_counter.collect(exp)
+        if self.packer is not None:
+            self._collect_packer(exp, self.packer)
+        if self.row_server is not None:
+            self._collect_row_server(exp, self.row_server)
+        return exp.render()
+
+    def _collect_loop(self, exp: Exposition) -> None:
+        lag = self.lag
+        exp.histogram(
+            'ablive_loop_lag_seconds', lag.histogram,
+            'How late the event loop wakes up from a sleep',
+        )
+        exp.gauge('ablive_loop_lag_last_seconds', lag.lag)
+        exp.gauge('ablive_loop_lag_max_seconds', lag.max_lag)
+
+    def _collect_rooms(self, exp: Exposition, rooms_worker: 'RoomsWorker') -> None:
+        for result, counts in (
+            ('parsed', command_stats.parsed), ('skipped', command_stats.skipped)
+        ):
+            for cmd, count in counts.items():
+                exp.counter(
+                    'ablive_messages', count, 'Messages received per command',
+                    {'cmd': cmd.decode(errors='replace'), 'result': result},
+                )
+
+        decoder = rooms_worker.decoder.stats()
+        for path in ('inline', 'batched'):
+            exp.counter(
+                'ablive_frames_decoded', decoder[f'frames_{path}'], '',
+                {'path': path},
+            )
+            exp.counter(
+                'ablive_decode_seconds', decoder[f'decode_seconds_{path}'],
+                'Time spent decoding frames, batched ones including the '
+                'executor wait',
+                {'path': path},
+            )
+        exp.counter('ablive_decoded_bytes', decoder['bytes'])
+        exp.counter('ablive_decode_queue_seconds', decoder['queue_seconds'])
+
+        states = client_states.stats()
+        for state in ('connecting', 'connected', 'failed'):
+            exp.gauge('ablive_rooms', states[state], '', {'state': state})
+        exp.counter('ablive_reconnects', states['reconnects'])
+
+        governor = rooms_worker.governor.stats()
+        exp.counter('ablive_connect_attempts', governor['attempts'])
+        exp.counter('ablive_connect_failures', governor['failures'])
+        exp.gauge('ablive_connect_waiting', governor['queue_depth'])
+        exp.gauge('ablive_open_circuits', governor['open_circuits'])
+
+        heartbeat = rooms_worker.heartbeat.stats()
+        exp.counter('ablive_heartbeat_failures', heartbeat['failures'])
+        exp.gauge('ablive_heartbeat_latency_max_seconds', heartbeat['latency_max'])
+
+        danmu_info = rooms_worker.danmu_info_service.stats()
+        for result in ('hits', 'misses', 'coalesced', 'errors'):
+            exp.counter(
+                'ablive_danmu_info_lookups', danmu_info[result], '',
+                {'result': result},
+            )
+
+    def _collect_packer(self, exp: Exposition, packer: 'Packer') -> None:
+        for sink in packer.sinks:
+            labels = {'buffer': sink.buffer.name, 'sink': sink.kind}
+            stats = sink.buffer.stats()
+            exp.gauge('ablive_buffer_rows', stats['depth'], 'Rows buffered', labels)
+            exp.gauge('ablive_buffer_bytes', stats['bytes'], '', labels)
+            exp.gauge('ablive_buffer_paused', stats['paused'], '', labels)
+            exp.counter('ablive_buffer_dropped', stats['dropped'], '', labels)
+            exp.counter('ablive_buffer_spilled', stats['spilled'], '', labels)
+            exp.histogram(
+                'ablive_sink_write_seconds', sink.write_time,
+                'Time a batch takes to write', labels,
+            )
+            exp.histogram(
+                'ablive_sink_latency_seconds', sink.latency,
+                'Seconds from an event to its row being written', labels,
+            )
+
+        if (db := packer.db) is not None:
+            exp.gauge('ablive_mysql_connections_in_use', db.in_use)
+            exp.histogram(
+                'ablive_mysql_wait_seconds', db.wait,
+                'Time waited for a pooled connection',
+            )
+
+        if (handoffs := packer.handoffs) is not None:
+            stats = handoffs.stats()
+            for side, rooms in (('in', 'incoming'), ('out', 'outgoing')):
+                exp.gauge(
+                    'ablive_handoff_rooms', stats[rooms], 'Rooms changing hands',
+                    {'side': side},
+                )
+                exp.counter(
+                    'ablive_handoff_dropped', stats[f'dropped_{side}'],
+                    'Events left to the other worker of a handoff', {'side': side},
+                )
+            exp.counter('ablive_handoff_gave_up', stats['gave_up'])
+
+        if (dedup := packer.dedup) is not None:
+            for cmd, count in dedup.dropped.items():
+                exp.counter(
+                    'ablive_dedup_dropped', count, 'Duplicate events dropped',
+                    {'cmd': cmd},
+                )
+
+    def _collect_row_server(self, exp: Exposition, server: 'RowServer') -> None:
+        exp.gauge('ablive_writer_clients', server.clients)
+        exp.counter('ablive_writer_batches', server.batches)
+        exp.counter('ablive_writer_rows', server.rows)
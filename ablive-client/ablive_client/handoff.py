@@ -0,0 +1,102 @@
+import logging
+import time
+from typing import Any, Container, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Handoffs:
+    """Rooms changing hands with another worker, split at a cutover ts.
+
+    For a while both workers run such a room. The one taking it over keeps
+    the events from the cutover on, the one giving it up those before, so
+    the overlap stores nothing twice. Until the server sets the cutover the
+    new worker keeps nothing, for at most `wait` seconds, and the old one
+    keeps everything.
+
+    Shared by `RoomsWorker`, which follows the server, and `Packer`, which
+    asks `keeps` for the events of these rooms.
+    """
+
+    IN = 'in'
+    OUT = 'out'
+
+    def __init__(self, wait: float = 90) -> None:
+        self.wait = wait
+        # liverid -> [IN or OUT, cutover or None, since]
+        self._rooms: dict[int, list[Any]] = {}
+        self.dropped = {self.IN: 0, self.OUT: 0}
+        self.gave_up = 0
+
+    def __contains__(self, liverid: int) -> bool:
+        return liverid in self._rooms
+
+    def receive(self, liverid: int, cutover: Optional[int]) -> None:
+        self._follow(liverid, self.IN, cutover)
+
+    def release(self, liverid: int, cutover: Optional[int]) -> None:
+        self._follow(liverid, self.OUT, cutover)
+
+    def _follow(self, liverid: int, side: str, cutover: Optional[int]) -> None:
+        entry = self._rooms.get(liverid)
+        if entry is None or entry[0] != side:
+            # a room changing hands the other way is a new handoff
+            self._rooms[liverid] = [side, cutover, time.monotonic()]
+        else:
+            entry[1] = cutover
+
+    def awaiting(self, liverid: int) -> bool:
+        """Taken over and the cutover still unknown."""
+        entry = self._rooms.get(liverid)
+        return entry is not None and entry[0] == self.IN and entry[1] is None
+
+    def side(self, liverid: int) -> Optional[str]:
+        entry = self._rooms.get(liverid)
+        return None if entry is None else entry[0]
+
+    def prune(
+        self, incoming: set[int], outgoing: set[int], running: Container[int]
+    ) -> None:
+        """Forgets the handoffs the server no longer lists: rooms taken over
+        are this worker's alone now, rooms given up once they are gone."""
+        for liverid, (side, _, _) in list(self._rooms.items()):
+            if side == self.IN and liverid not in incoming:
+                del self._rooms[liverid]
+            elif side == self.OUT and liverid not in outgoing \
+                    and liverid not in running:
+                del self._rooms[liverid]
+
+    def discard(self, liverid: int) -> None:
+        self._rooms.pop(liverid, None)
+
+    def keeps(self, liverid: int, ts: float) -> bool:
+        if (entry := self._rooms.get(liverid)) is None:
+            return True
+        side, cutover, since = entry
+        if cutover is None:
+            if side == self.OUT:
+                return True
+            if time.monotonic() - since > self.wait:
+                # the old worker is likely gone, better twice than never
+                logger.warning(
+                    f'[{liverid}] no cutover after {self.wait}s, keeping all'
+                )
+                self.gave_up += 1
+                self.discard(liverid)
+                return True
+            kept = False
+        else:
+            kept = (ts >= cutover) == (side == self.IN)
+        if not kept:
+            self.dropped[side] += 1
+        return kept
+
+    def stats(self) -> dict[str, Any]:
+        incoming = sum(1 for e in self._rooms.values() if e[0] == self.IN)
+        return {
+            'incoming': incoming,
+            'outgoing': len(self._rooms) - incoming,
+            'dropped_in': self.dropped[self.IN],
+            'dropped_out': self.dropped[self.OUT],
+            'gave_up': self.gave_up,
+        }
@@ -0,0 +1,64 @@
+import math
+from typing import Optional
+
+_MASK = (1 << 64) - 1
+
+
+def _mix64(x: int) -> int:
+    # splitmix64 finalizer, uids are far from uniformly distributed
+    x = (x + 0x9E3779B97F4A7C15) & _MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+class HyperLogLog:
+    """Approximate distinct count of integers, ~1.04/sqrt(2**p) error.
+
+    Small sets are counted exactly and only turn into `2**p` registers once
+    they outgrow what those would cost.
+    """
+
+    __slots__ = ('p', '_exact', '_registers')
+
+    def __init__(self, p: int = 10) -> None:
+        self.p = p
+        self._exact: Optional[set[int]] = set()
+        self._registers: Optional[bytearray] = None
+
+    def add(self, value: int) -> None:
+        if self._exact is not None:
+            self._exact.add(value)
+            # a set entry costs well over 8 bytes, a register 1
+            if len(self._exact) > (1 << self.p) // 8:
+                self._densify()
+            return
+        self._add(value)
+
+    def _add(self, value: int) -> None:
+        assert self._registers is not None
+        x = _mix64(value)
+        bits = 64 - self.p
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def _densify(self) -> None:
+        assert self._exact is not None
+        exact, self._exact = self._exact, None
+        self._registers = bytearray(1 << self.p)
+        for value in exact:
+            self._add(value)
+
+    def count(self) -> int:
+        if self._exact is not None:
+            return len(self._exact)
+        assert self._registers is not None
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        if estimate <= 2.5 * m and (zeros := self._registers.count(0)):
+            # linear counting is better for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
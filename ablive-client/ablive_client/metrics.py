@@ -0,0 +1,120 @@
+import asyncio
+from bisect import bisect_left
+from typing import Any, Iterable, Sequence
+
+
+class Histogram:
+    """Cumulative-bucket histogram, the shape Prometheus expects."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # the last slot is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_many(self, values: Iterable[float]) -> None:
+        buckets = self.buckets
+        counts = self.counts
+        n = 0
+        total = 0.0
+        for value in values:
+            counts[bisect_left(buckets, value)] += 1
+            total += value
+            n += 1
+        self.sum += total
+        self.count += n
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        result = []
+        running = 0
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class LoopLagMonitor:
+    """How late the event loop wakes up from a `interval` seconds sleep.
+
+    The loop counts as settled once `settle_samples` lags in a row stay
+    under `settle_lag`.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        settle_lag: float = 0.1,
+        settle_samples: int = 4,
+    ) -> None:
+        self.interval = interval
+        self.settle_lag = settle_lag
+        self.settle_samples = settle_samples
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.histogram = Histogram((0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+        self._streak = 0
+        self._settled = asyncio.Event()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - t0 - self.interval)
+            self.lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.histogram.observe(lag)
+            if lag < self.settle_lag:
+                self._streak += 1
+                if self._streak >= self.settle_samples:
+                    self._settled.set()
+            else:
+                self._streak = 0
+                self._settled.clear()
+
+    async def wait_settled(self) -> None:
+        await self._settled.wait()
+
+
+class SpaceSaving:
+    """Counts of the `capacity` heaviest keys of a stream (Space-Saving).
+
+    A key arriving when all slots are taken evicts the smallest count and
+    inherits it, so a count is over by at most that inherited `error` and
+    any key seen more than total/capacity times is kept.
+    """
+
+    def __init__(self, capacity: int = 50) -> None:
+        self.capacity = capacity
+        self.total = 0
+        self._counts: dict[Any, int] = {}
+        self._errors: dict[Any, int] = {}
+
+    def add(self, key: Any, n: int = 1) -> None:
+        self.total += n
+        counts = self._counts
+        if key in counts:
+            counts[key] += n
+        elif len(counts) < self.capacity:
+            counts[key] = n
+            self._errors[key] = 0
+        else:
+            victim = min(counts, key=counts.__getitem__)
+            floor = counts.pop(victim)
+            del self._errors[victim]
+            counts[key] = floor + n
+            self._errors[key] = floor
+
+    def top(self) -> list[tuple[Any, int, int]]:
+        """(key, count, error), heaviest first."""
+        return sorted(
+            ((k, c, self._errors[k]) for k, c in self._counts.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
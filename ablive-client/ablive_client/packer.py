@@ -1,16 +1,37 @@
 import asyncio
-from asyncio import Queue
 import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional, Sequence
 
 import sqlalchemy as sa
 
-from .blrec import Danmaku, DanmakuCommand, DanmakuListener
+from . import bulk
+from .blrec import Danmaku, DanmakuListener
+from .blrec.event_emitter import EventEmitter
+from .buffer import RowBuffer
+from .database import ConnectionManager
+from .dedup import Deduplicator
+from .events import DEDUP_KEYS, EVENT_ROUTES, Dispatcher
+from .handoff import Handoffs
+from .parquet import ParquetSink
+from .remote import RemoteSink
+from .rollup import ROLLUP_UPSERT, RollupListener, rollup_table
+from .sink import Sink
+from .spool import Spool
 from .storer import Storer
+from .uname import UnameDirectory
 
 logger = logging.getLogger(__name__)
 
 
-class Packer(DanmakuListener):
+class Packer(DanmakuListener, EventEmitter[DanmakuListener]):
+    """Turns events into rows for the sinks, and passes the events it kept
+    on to its own listeners."""
+
+    # seconds before a crashed spool, sink or rollup loop is started again
+    RESTART_DELAY = 5
+
     table_gen_map = {
         "ablive_en": lambda name: sa.Table(
             name,
@@ -63,201 +84,269 @@ class Packer(DanmakuListener):
         ),
     }
 
-    def __init__(self, mysql_config):
-        self.buffer: dict[str, Queue] = {}
-        self.storers: list[Storer] = []
+    dispatcher = Dispatcher(EVENT_ROUTES)
+    commands = dispatcher.commands
+
+    def __init__(
+        self,
+        mysql_config: Optional[str] = None,
+        buffer_maxsize: int = 0,
+        buffer_policies: Optional[dict[str, str]] = None,
+        spill_dir: str = 'spill',
+        spool_dir: Optional[str] = None,
+        spool_options: Optional[dict] = None,
+        pool_size: int = 4,
+        sinks: Sequence[str] = (Storer.kind,),
+        sink_options: Optional[dict] = None,
+        storer_options: Optional[dict] = None,
+        parquet_options: Optional[dict] = None,
+        remote_options: Optional[dict] = None,
+        dedup_window: float = 600,
+        dedup_max_keys: int = 2000000,
+        uname_options: Optional[dict] = None,
+        rollup_options: Optional[dict] = None,
+        handoffs: Optional[Handoffs] = None,
+    ):
+        super().__init__()
+        # every sink drains a buffer of its own, rows are put to all of them
+        self.buffers: dict[str, list[RowBuffer]] = {}
+        self.sinks: list[Sink] = []
         self._tasks = []
         self._running = False
+        self._buffer_options = dict(
+            maxsize=buffer_maxsize,
+            spill_dir=spill_dir,
+            spool_dir=spool_dir,
+            spool_options=spool_options or {},
+        )
+        buffer_policies = buffer_policies or {}
+        sink_options = sink_options or {}
+        storer_options = storer_options or {}
+        remote_options = remote_options or {}
+        # copies of an event come back after reconnects, 0 turns this off
+        self.dedup: Optional[Deduplicator] = None
+        if dedup_window:
+            self.dedup = Deduplicator(
+                DEDUP_KEYS, window=dedup_window, max_keys=dedup_max_keys
+            )
+
+        # rooms shared with another worker for a while, split at a cutover
+        self.handoffs = handoffs
+
+        self.db: Optional[ConnectionManager] = None
+        if Storer.kind in sinks:
+            self.db = ConnectionManager(
+                mysql_config,
+                pool_size=pool_size,
+                # LOAD DATA LOCAL INFILE is refused unless the client opts in
+                local_infile=storer_options.get('insert_strategy') == bulk.LOAD_DATA,
+            )
+        # normalized mode, uname is kept once per uid instead of per row
+        self.unames: Optional[UnameDirectory] = None
+        if self.db is not None and uname_options is not None:
+            self.unames = UnameDirectory(self.db, **uname_options)
 
         for schema_name, table_gen in self.table_gen_map.items():
-            buffer = Queue()
-            self.buffer[schema_name] = buffer
-            storer = Storer(mysql_config, table_gen, buffer, schema_name)
-            self.storers.append(storer)
-
-        self.buffer_dm = self.buffer['ablive_dm']
-        self.buffer_en = self.buffer['ablive_en']
-        self.buffer_gf = self.buffer['ablive_gf']
-        self.buffer_sc = self.buffer['ablive_sc']
+            self.buffers[schema_name] = []
+            for kind in sinks:
+                # MySQL keeps the bare schema name, for its spill/spool paths
+                name = schema_name if kind == Storer.kind else f'{schema_name}.{kind}'
+                buffer = self._new_buffer(
+                    name, buffer_policies.get(schema_name, RowBuffer.PAUSE)
+                )
+                sink: Sink
+                if kind == Storer.kind:
+                    assert self.db is not None
+                    sink = Storer(
+                        self.db,
+                        table_gen,
+                        buffer,
+                        schema_name,
+                        unames=self.unames,
+                        **storer_options,
+                        **sink_options,
+                    )
+                elif kind == ParquetSink.kind:
+                    sink = ParquetSink(
+                        buffer,
+                        schema_name,
+                        table_gen,
+                        **(parquet_options or {}),
+                        **sink_options,
+                    )
+                elif kind == RemoteSink.kind:
+                    sink = RemoteSink(
+                        buffer,
+                        schema_name,
+                        table_gen,
+                        **remote_options,
+                        **sink_options,
+                    )
+                else:
+                    raise ValueError(f'unknown sink: {kind}')
+                self.buffers[schema_name].append(buffer)
+                self.sinks.append(sink)
+
+        # per room, per minute aggregates, stored next to the raw tables
+        self.rollup: Optional[RollupListener] = None
+        if rollup_options is not None:
+            rollup_options = dict(rollup_options)
+            schema_name = rollup_options.pop('schema', 'ablive_rollup')
+            buffer = self._new_buffer(schema_name, RowBuffer.PAUSE)
+            if self.db is not None:
+                sink = Storer(
+                    self.db,
+                    rollup_table,
+                    buffer,
+                    schema_name,
+                    insert_strategy=bulk.MULTIROW,
+                    on_duplicate=ROLLUP_UPSERT,
+                    **sink_options,
+                )
+            elif RemoteSink.kind in sinks:
+                sink = RemoteSink(
+                    buffer,
+                    schema_name,
+                    rollup_table,
+                    **remote_options,
+                    **sink_options,
+                )
+            else:
+                raise ValueError('rollups need the mysql or the remote sink')
+            self.buffers[schema_name] = [buffer]
+            self.sinks.append(sink)
+            self.rollup = RollupListener(buffer, **rollup_options)
+            self.add_listener(self.rollup)
+
+    def _new_buffer(self, name: str, policy: str) -> RowBuffer:
+        spool_dir = self._buffer_options['spool_dir']
+        return RowBuffer(
+            name,
+            maxsize=self._buffer_options['maxsize'],
+            policy=policy,
+            spill_dir=self._buffer_options['spill_dir'],
+            spool=Spool(
+                os.path.join(spool_dir, name), **self._buffer_options['spool_options']
+            ) if spool_dir else None,
+        )
 
     async def run(self):
         if self._running:
             return
         self._running = True
-        for s in self.storers:
-            _task = s.run()
-            self._tasks.append(_task)
-            asyncio.create_task(_task)
+        for sink in self.sinks:
+            buffer = sink.buffer
+            if buffer.spool is None:
+                continue
+            if n := buffer.replay():
+                logger.info(f'{buffer.name} replayed {n} rows from the spool')
+            self._start(f'{buffer.name} spool', buffer.spool.run)
+        for sink in self.sinks:
+            self._start(f'{sink.buffer.name} {sink.kind} sink', sink.run)
+        if self.rollup is not None:
+            self._start('rollup', self.rollup.run)
+
+    def _start(self, name: str, run: Callable[[], Awaitable[None]]) -> None:
+        # a loop that dies is started again, else its buffer just grows
+        if not self._running:
+            # closed meanwhile
+            return
+        task = asyncio.create_task(run())
+        self._tasks.append(task)
+
+        def done(task: asyncio.Task) -> None:
+            if task.cancelled():
+                # by `close`
+                return
+            self._tasks.remove(task)
+            logger.error(
+                f'{name} stopped: {task.exception()!r}, '
+                f'restarting in {self.RESTART_DELAY}s'
+            )
+            asyncio.get_running_loop().call_later(
+                self.RESTART_DELAY, self._start, name, run
+            )
+
+        task.add_done_callback(done)
+
+    async def close(self) -> None:
+        """Stops the loops and lets the sinks finish their files and
+        batches; what is still buffered stays in the spool."""
+        self._running = False
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for sink in self.sinks:
+            try:
+                await sink.close()
+            except Exception as e:
+                logger.error(f'{sink.buffer.name} failed to close: {e!r}')
+            sink.buffer.close()
+
+    def _put(self, table: str, row: dict) -> None:
+        for buffer in self.buffers[table]:
+            buffer.put_nowait(row)
+
+    def put_rows(self, table: str, rows: list[dict]) -> None:
+        """Rows made elsewhere, e.g. by an ingest process, see RowServer.
+        Callers wait for `wait_writable` first."""
+        buffers = self.buffers[table]
+        for row in rows:
+            for buffer in buffers:
+                buffer.put_nowait(row)
 
     async def on_danmaku_received(self, danmu: Danmaku) -> None:
-        cmd: str = danmu['cmd']
+        if self._pack(danmu['liverid'], danmu) and self._listeners:
+            await self._emit('danmaku_received', danmu)
+        await self.wait_writable()
+
+    async def on_danmaku_batch(self, liverid: int, danmus: list[Danmaku]) -> None:
+        kept = [danmu for danmu in danmus if self._pack(liverid, danmu)]
+        if kept and self._listeners:
+            await self._emit('danmaku_batch', liverid, kept)
+        await self.wait_writable()
+
+    async def wait_writable(self) -> None:
+        # holding the client here stops it from reading its websocket
+        for sink in self.sinks:
+            buffer = sink.buffer
+            if buffer.paused:
+                await buffer.wait_writable()
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            **({'mysql': self.db.stats()} if self.db is not None else {}),
+            **({'dedup': self.dedup.stats()} if self.dedup is not None else {}),
+            **({'uname': self.unames.stats()} if self.unames is not None else {}),
+            **({'rollup': self.rollup.stats()} if self.rollup is not None else {}),
+            **(
+                {'handoffs': self.handoffs.stats()}
+                if self.handoffs is not None else {}
+            ),
+            **{sink.buffer.name: sink.stats() for sink in self.sinks},
+        }
 
+    def _pack(self, liverid: int, danmu: Danmaku) -> bool:
+        # False for a copy of an event seen before
         try:
-            if cmd.startswith(DanmakuCommand.DANMU_MSG.value):
-                self.on_danmu_msg(danmu)
-            elif cmd == DanmakuCommand.INTERACT_WORD.value:
-                self.on_interact_word(danmu)
-            # elif cmd == DanmakuCommand.ENTRY_EFFECT.value:
-            #     self.on_entry_effect(danmu)
-            elif cmd == DanmakuCommand.SEND_GIFT.value:
-                self.on_send_gift(danmu)
-            elif cmd == DanmakuCommand.USER_TOAST_MSG.value:
-                self.on_user_toast_msg(danmu)
-            elif cmd == DanmakuCommand.SUPER_CHAT_MESSAGE.value:
-                self.on_super_chat_message(danmu)
-            elif cmd == DanmakuCommand.USER_VIRTUAL_MVP.value:
-                self.on_user_virtual_mvp(danmu)
-
+            if self.dedup is not None and self.dedup.seen(liverid, danmu):
+                return False
+            if self.handoffs is not None and liverid in self.handoffs:
+                return self._pack_handoff(liverid, danmu)
+            self.dispatcher.dispatch(liverid, danmu, self._put)
         except Exception as e:
             logger.error(f'error in pack_dog: {e}')
-
-    def on_interact_word(self, msg):
-        liverid = msg['liverid']
-        msg = msg['data']
-
-        sql_data = {
-            'ts': msg['timestamp'],
-            'uid': msg['uid'],
-            'uname': msg['uname'],
-            'liverid': liverid,
-        }
-
-        self.buffer_en.put_nowait(sql_data)
-
-    def on_entry_effect(self, msg):
-        liverid = msg['liverid']
-        msg = msg['data']
-
-        ts = int(msg['trigger_time'] / 1000000000)
-        uid = msg['uid']
-        _uname = msg['copy_writing_v2'].split('%')[1]
-        uname = f'[欢迎舰长]{_uname}'
-
-        self.buffer_en.put_nowait(
-            {
-                'ts': ts,
-                'uid': uid,
-                'uname': uname,
-                'liverid': liverid,
-            }
-        )
-
-    def on_danmu_msg(self, msg):
-        liverid = msg['liverid']
-        msg = msg['info']
-
-        text = msg[1]
-        if isinstance(msg[0][13], dict):
-            text = f'[{text}]'
-
-        sql_data = {
-            # 'ts': msg[0][4] // 1000,
-            'ts': msg[9]['ts'],
-            'uid': msg[2][0],
-            'uname': msg[2][1],
-            'text': text,
-            'liverid': liverid,
-        }
-
-        self.buffer_dm.put_nowait(sql_data)
-
-    def on_send_gift(self, msg):
-        liverid = msg['liverid']
-        msg = msg['data']
-        # 不储存免费礼物
-        if not msg['discount_price']:
-            return
-
-        sql_data = {
-            'ts': msg['timestamp'],
-            'uid': msg['uid'],
-            'uname': msg['uname'],
-            'liverid': liverid,
-        }
-        _gift_name = msg['giftName']
-        _gift_num = msg['num']
-        gift_info = f'{_gift_name}x{_gift_num}'
-        gift_cost = (msg['discount_price'] * _gift_num) / 1000
-        # 记录盲盒内容
-        if msg['blind_gift']:
-            # e.g. '[紫金宝盒]玫瑰x4'
-            gift_info = '[%s]%s' % (msg['blind_gift']['original_gift_name'], gift_info)
-            gift_cost = msg['total_coin'] / 1000
-
-        self.buffer_gf.put_nowait(
-            {
-                **sql_data,
-                'gift_info': gift_info,
-                'gift_cost': gift_cost,
-            }
-        )
-
-    def on_user_virtual_mvp(self, msg):
-        liverid = msg['liverid']
-        msg = msg['data']
-
-        gift_info = f'[MVP]{msg["action"]}{msg["goods_name"]}x{msg["goods_num"]}'
-        self.buffer_gf.put_nowait(
-            {
-                'ts': msg["timestamp"],
-                'uid': msg["uid"],
-                'uname': msg["uname"],
-                'liverid': liverid,
-                'gift_info': gift_info,
-                'gift_cost': msg["goods_price"] / 1000,
-            }
-        )
-
-    def on_super_chat_message(self, msg):
-        liverid = msg['liverid']
-        msg = msg['data']
-
-        sql_data = {
-            'ts': msg['ts'],
-            'uid': msg['uid'],
-            'uname': msg['user_info']['uname'],
-            'liverid': liverid,
-        }
-        sc_price = msg['price']
-        _sc_msg = msg['message']
-        text = '[%ssc] %s' % (sc_price, _sc_msg)
-
-        self.buffer_dm.put_nowait(
-            {
-                **sql_data,
-                'text': text,
-            }
-        )
-
-        self.buffer_gf.put_nowait(
-            {
-                **sql_data,
-                'gift_info': '[SuperChat]',
-                'gift_cost': sc_price,
-            }
-        )
-
-        self.buffer_sc.put_nowait(
-            {
-                **sql_data,
-                'text': msg['message'],
-                'sc_price': sc_price,
-            }
-        )
-
-    def on_user_toast_msg(self, msg):
-        liverid = msg['liverid']
-        msg = msg['data']
-
-        _toast_msg = msg['toast_msg'].split('，')[-1]
-
-        sql_data = {
-            'ts': msg['start_time'],
-            'uid': msg['uid'],
-            'uname': msg['username'],
-            'liverid': liverid,
-            'gift_info': f'[大航海]{_toast_msg}',
-            'gift_cost': msg['price'] / 1000,
-        }
-
-        self.buffer_gf.put_nowait(sql_data)
+        return True
+
+    def _pack_handoff(self, liverid: int, danmu: Danmaku) -> bool:
+        assert self.handoffs is not None
+        rows: list[tuple[str, dict]] = []
+        self.dispatcher.dispatch(liverid, danmu, lambda t, r: rows.append((t, r)))
+        # the rows of one event share its ts, events without rows go by now
+        ts = rows[0][1]['ts'] if rows else time.time()
+        if not self.handoffs.keeps(liverid, ts):
+            return False
+        for table, row in rows:
+            self._put(table, row)
+        return True
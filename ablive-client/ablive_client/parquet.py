@@ -0,0 +1,211 @@
+# Used by packer.Packer only
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+
+import sqlalchemy as sa
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only this sink needs it
+    pa = pq = None
+
+from .buffer import RowBuffer
+from .partition import DAY, TimePartitioner
+from .sink import Sink
+from .spool import Acks
+
+logger = logging.getLogger(__name__)
+
+# repeated a lot within a file, cheap to dictionary-encode
+DICTIONARY_COLUMNS = ('uname', 'liverid')
+
+
+def arrow_schema(table: sa.Table) -> 'pa.Schema':
+    """The Arrow schema of `table`'s columns, without the autoincrement
+    one."""
+    auto = table.autoincrement_column
+    return pa.schema([
+        pa.field(c.name, _arrow_type(c.type), nullable=c.nullable)
+        for c in table.columns if c is not auto
+    ])
+
+
+def _arrow_type(type_: sa.types.TypeEngine) -> 'pa.DataType':
+    if isinstance(type_, sa.BigInteger):
+        return pa.int64()
+    if isinstance(type_, sa.Integer):
+        return pa.int32()
+    if isinstance(type_, sa.Numeric):
+        # the rows carry floats already
+        return pa.float64()
+    if isinstance(type_, sa.String):
+        return pa.string()
+    raise TypeError(f'no arrow type for {type_!r}')
+
+
+class ParquetSink(Sink):
+    """Writes a schema's rows to Parquet files, one directory per day or
+    hour: `{directory}/{schema}/{period}={name}/part-*.parquet`.
+
+    Rows are written in row groups of `row_group_rows`. Open files are
+    closed and renamed into place together, once `file_max_rows` rows went
+    in, `file_max_age` seconds passed or the period is over; only then are
+    their rows acknowledged to the spool. Files still being written start
+    with a dot, which readers skip.
+    """
+
+    kind = 'parquet'
+    retryable = (OSError,)
+
+    def __init__(
+        self,
+        buffer: RowBuffer,
+        name: str,
+        table_gen: Callable[[str], sa.Table],
+        directory: str = 'parquet',
+        period: str = DAY,
+        row_group_rows: int = 100000,
+        file_max_rows: int = 1000000,
+        file_max_age: float = 600,
+        compression: str = 'zstd',
+        **options: Any,
+    ) -> None:
+        if pa is None:
+            raise RuntimeError('the parquet sink needs pyarrow installed')
+        # files are written from one thread at a time
+        options['max_inflight'] = 1
+        super().__init__(buffer, name, **options)
+        self.directory = os.path.join(directory, name)
+        self.partitioner = TimePartitioner(period)
+        self.schema = arrow_schema(table_gen(name))
+        self.row_group_rows = row_group_rows
+        self.file_max_rows = file_max_rows
+        self.file_max_age = file_max_age
+        self.compression = compression
+
+        # tables short of a row group, by partition
+        self._groups: dict[str, list['pa.Table']] = {}
+        self._writers: dict[str, tuple['pq.ParquetWriter', str, str]] = {}
+        self._file_rows = 0
+        self._opened_at = 0.0
+        self._opened_in = ''
+        self._seq = 0
+        self._unacked: list[Acks] = []
+        self._io = asyncio.Lock()
+        self._roll_task: Optional[asyncio.Task] = None
+        self.files = 0
+
+    async def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._roll_task = asyncio.create_task(self._roll_loop())
+
+    async def write(self, rows: list[dict[str, Any]]) -> None:
+        loop = asyncio.get_running_loop()
+        # bad rows fail here, before anything of the batch is kept
+        tables = await loop.run_in_executor(None, self._to_tables, rows)
+        async with self._io:
+            if not self._file_rows:
+                self._opened_at = time.monotonic()
+                self._opened_in = self.partitioner.name(time.time())
+            try:
+                for name, table in tables.items():
+                    group = self._groups.setdefault(name, [])
+                    group.append(table)
+                    if sum(t.num_rows for t in group) >= self.row_group_rows:
+                        await loop.run_in_executor(None, self._write_group, name)
+            except BaseException:
+                # the batch is requeued, what of it wasn't written goes too
+                for name, table in tables.items():
+                    group = self._groups.get(name, [])
+                    if group and group[-1] is table:
+                        group.pop()
+                        if not group:
+                            del self._groups[name]
+                raise
+            self._file_rows += len(rows)
+            if self._file_rows >= self.file_max_rows:
+                await self._roll()
+
+    def committed(self, acks: Acks) -> None:
+        # not durable before the file is closed
+        self._unacked.append(acks)
+
+    async def _roll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.file_max_age, 10))
+            if not self._file_rows:
+                continue
+            expired = time.monotonic() - self._opened_at >= self.file_max_age
+            if expired or self.partitioner.name(time.time()) != self._opened_in:
+                async with self._io:
+                    try:
+                        await self._roll()
+                    except Exception as e:
+                        logger.error(f'{self.buffer.name} roll failed: {e!r}')
+
+    async def _roll(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._close_all)
+        self._file_rows = 0
+        unacked, self._unacked = self._unacked, []
+        for acks in unacked:
+            self.buffer.ack(acks)
+
+    def _to_tables(self, rows: list[dict[str, Any]]) -> dict[str, 'pa.Table']:
+        return {
+            name: pa.Table.from_pylist(part, schema=self.schema)
+            for name, part in self.partitioner.group(rows).items()
+        }
+
+    def _write_group(self, name: str) -> None:
+        if (entry := self._writers.get(name)) is None:
+            part_dir = os.path.join(
+                self.directory, f'{self.partitioner.period}={name}'
+            )
+            os.makedirs(part_dir, exist_ok=True)
+            self._seq += 1
+            filename = f'part-{os.getpid()}-{int(time.time())}-{self._seq}.parquet'
+            path = os.path.join(part_dir, filename)
+            tmp_path = os.path.join(part_dir, f'.{filename}.tmp')
+            writer = pq.ParquetWriter(
+                tmp_path,
+                self.schema,
+                compression=self.compression,
+                use_dictionary=[
+                    c for c in DICTIONARY_COLUMNS if c in self.schema.names
+                ],
+            )
+            entry = self._writers[name] = (writer, tmp_path, path)
+        table = pa.concat_tables(self._groups[name])
+        entry[0].write_table(table, row_group_size=self.row_group_rows)
+        # only once written, a failed write keeps them for the next try
+        del self._groups[name]
+
+    def _close_all(self) -> None:
+        for name in list(self._groups):
+            self._write_group(name)
+        writers, self._writers = self._writers, {}
+        for writer, tmp_path, path in writers.values():
+            writer.close()
+            os.replace(tmp_path, path)
+            self.files += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **super().stats(),
+            'open_files': len(self._writers),
+            'files': self.files,
+        }
+
+    async def close(self) -> None:
+        await super().close()
+        if self._roll_task is not None:
+            self._roll_task.cancel()
+        async with self._io:
+            if self._file_rows or self._groups:
+                await self._roll()
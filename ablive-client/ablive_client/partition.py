@@ -0,0 +1,54 @@
+# Used by storer.Storer and parquet.ParquetSink only
+
+import time
+from collections import deque
+from typing import Any, Iterable
+
+DAY = 'day'
+HOUR = 'hour'
+
+PERIOD_FORMATS = {DAY: '%Y_%m_%d', HOUR: '%Y_%m_%d_%H'}
+
+
+class TimePartitioner:
+    """Routes rows to their local day (or hour) by the row's own `ts`."""
+
+    def __init__(self, period: str = DAY, remember: int = 4) -> None:
+        if period not in PERIOD_FORMATS:
+            raise ValueError(f'unknown partition period: {period}')
+        self.period = period
+        self.format = PERIOD_FORMATS[period]
+        # (start, end, name) of the periods seen last, late rows come in bursts
+        self._seen: deque[tuple[int, int, str]] = deque(maxlen=remember)
+
+    def name(self, ts: float) -> str:
+        for start, end, name in self._seen:
+            if start <= ts < end:
+                return name
+        return self._locate(ts)
+
+    def _locate(self, ts: float) -> str:
+        tm = time.localtime(ts)
+        y, m, d = tm.tm_year, tm.tm_mon, tm.tm_mday
+        # mktime normalises day+1 / hour+1 and works out DST by itself
+        if self.period == HOUR:
+            h = tm.tm_hour
+            start = int(time.mktime((y, m, d, h, 0, 0, 0, 0, -1)))
+            end = int(time.mktime((y, m, d, h + 1, 0, 0, 0, 0, -1)))
+        else:
+            start = int(time.mktime((y, m, d, 0, 0, 0, 0, 0, -1)))
+            end = int(time.mktime((y, m, d + 1, 0, 0, 0, 0, 0, -1)))
+        name = time.strftime(self.format, tm)
+        self._seen.appendleft((start, end, name))
+        return name
+
+    def group(
+        self, rows: Iterable[dict[str, Any]]
+    ) -> dict[str, list[dict[str, Any]]]:
+        groups: dict[str, list[dict[str, Any]]] = {}
+        for row in rows:
+            name = self.name(row['ts'])
+            if (group := groups.get(name)) is None:
+                group = groups[name] = []
+            group.append(row)
+        return groups
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import struct
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+import orjson as json
+import sqlalchemy as sa
+
+from . import bulk
+from .buffer import RowBuffer
+from .sink import Sink
+
+if TYPE_CHECKING:
+    from .packer import Packer
+
+logger = logging.getLogger(__name__)
+
+# a frame is its length and an orjson payload; a batch is
+# [sender, first, schema, [column, ...], [[value, ...], ...]], the reply b'ok'
+# or an error. `first` numbers the batch's first row in the sender's stream.
+_FRAME_HEADER = struct.Struct('>I')
+_OK = b'ok'
+
+
+class RemoteError(Exception):
+    pass
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    size, = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    return await reader.readexactly(size)
+
+
+def _frame(payload: bytes) -> bytes:
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+class RemoteSink(Sink):
+    """Hands a schema's rows to a writer process, see `RowServer`.
+
+    Rows travel as arrays in column order, so only values cross the
+    socket. A batch counts as written once the writer has buffered it.
+
+    Rows are numbered as they are sent, so a batch sent again after a lost
+    reply only adds the rows the writer doesn't have yet. That holds as a
+    requeued batch goes back to the front of the buffer and only one batch
+    is in flight.
+    """
+
+    kind = 'remote'
+    retryable = (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError)
+
+    def __init__(
+        self,
+        buffer: RowBuffer,
+        name: str,
+        table_gen: Callable[[str], sa.Table],
+        host: str = '127.0.0.1',
+        port: int = 7460,
+        timeout: float = 60,
+        **options: Any,
+    ) -> None:
+        # one batch at a time per connection
+        options['max_inflight'] = 1
+        super().__init__(buffer, name, **options)
+        self.columns = bulk.insert_columns(table_gen(name))
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # tells this sink's rows apart from a previous process's
+        self._sender = os.urandom(8).hex()
+        self._sent = 0
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def write(self, rows: list[dict[str, Any]]) -> None:
+        columns = self.columns
+        payload = json.dumps([
+            self._sender,
+            self._sent,
+            self.schema_name,
+            columns,
+            [[row[c] for c in columns] for row in rows],
+        ])
+        try:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            assert self._reader is not None
+            self._writer.write(_frame(payload))
+            await self._writer.drain()
+            # the writer answers once it has room, that's the backpressure,
+            # so no timeout while it's there
+            reply = await _read_frame(self._reader)
+        except BaseException:
+            self._close()
+            raise
+        if reply != _OK:
+            raise RemoteError(reply.decode(errors='replace'))
+        self._sent += len(rows)
+
+    def _close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class RowServer:
+    """The writer process's end of `RemoteSink`, rows go to its `Packer`."""
+
+    def __init__(
+        self,
+        packer: 'Packer',
+        host: str = '127.0.0.1',
+        port: int = 7460,
+    ) -> None:
+        self.packer = packer
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        # sender -> rows of its stream buffered so far
+        self._accepted: dict[str, int] = {}
+        self.clients = 0
+        self.batches = 0
+        self.rows = 0
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port
+        )
+
+    async def serve_forever(self) -> None:
+        assert self._server is not None
+        await self._server.serve_forever()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.clients += 1
+        try:
+            while True:
+                payload = await _read_frame(reader)
+                try:
+                    sender, first, schema, columns, values = json.loads(payload)
+                    # room first, whatever is taken in is answered right away
+                    await self.packer.wait_writable()
+                    accepted = self._accepted.get(sender, 0)
+                    self.packer.put_rows(schema, [
+                        dict(zip(columns, v))
+                        for v in values[max(accepted - first, 0):]
+                    ])
+                    self._accepted[sender] = max(accepted, first + len(values))
+                except Exception as e:
+                    logger.error(f'bad batch from an ingest process: {e!r}')
+                    writer.write(_frame(repr(e).encode()))
+                else:
+                    self.batches += 1
+                    self.rows += len(values)
+                    writer.write(_frame(_OK))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {'clients': self.clients, 'batches': self.batches, 'rows': self.rows}
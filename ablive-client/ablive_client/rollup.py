@@ -0,0 +1,170 @@
+import asyncio
+import time
+from typing import Any, Callable
+
+import sqlalchemy as sa
+
+from .blrec import Danmaku, DanmakuCommand, DanmakuListener
+from .buffer import RowBuffer
+from .events import Extractor, _gift_cost, path
+from .hll import HyperLogLog
+
+# measures that add up when a late part of a minute is stored again
+_ADDITIVE = ('danmaku', 'entries', 'gifts', 'gift_cost', 'sc', 'sc_price')
+
+ROLLUP_UPSERT = ', '.join(
+    [f'`{c}` = `{c}` + VALUES(`{c}`)' for c in _ADDITIVE]
+    + ['`senders` = GREATEST(`senders`, VALUES(`senders`))']
+)
+
+
+def rollup_table(name: str) -> sa.Table:
+    return sa.Table(
+        name,
+        sa.MetaData(),
+        # start of the minute
+        sa.Column('ts', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('liverid', sa.BigInteger, primary_key=True, autoincrement=False),
+        sa.Column('danmaku', sa.Integer, nullable=False),
+        # distinct danmaku senders, approximate
+        sa.Column('senders', sa.Integer, nullable=False),
+        sa.Column('entries', sa.Integer, nullable=False),
+        sa.Column('gifts', sa.Integer, nullable=False),
+        # paid gifts, guards and MVPs; super chats are in sc_price only
+        sa.Column('gift_cost', sa.DECIMAL(12, 1), nullable=False),
+        sa.Column('sc', sa.Integer, nullable=False),
+        sa.Column('sc_price', sa.DECIMAL(12, 1), nullable=False),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8mb4',
+    )
+
+
+class _Window:
+    __slots__ = _ADDITIVE + ('senders',)
+
+    def __init__(self, precision: int) -> None:
+        self.danmaku = self.entries = self.gifts = self.sc = 0
+        self.gift_cost = self.sc_price = 0.0
+        self.senders = HyperLogLog(precision)
+
+
+# each reads what it needs before touching the window, so a malformed
+# message adds nothing
+def _danmu(w: _Window, msg: Danmaku) -> None:
+    w.senders.add(msg['info'][2][0])
+    w.danmaku += 1
+
+
+def _entry(w: _Window, msg: Danmaku) -> None:
+    w.entries += 1
+
+
+def _gift(w: _Window, msg: Danmaku) -> None:
+    # free gifts aren't stored either
+    if msg['data']['discount_price']:
+        w.gift_cost += _gift_cost(msg)
+        w.gifts += 1
+
+
+def _guard(w: _Window, msg: Danmaku) -> None:
+    w.gift_cost += msg['data']['price'] / 1000
+    w.gifts += 1
+
+
+def _mvp(w: _Window, msg: Danmaku) -> None:
+    w.gift_cost += msg['data']['goods_price'] / 1000
+    w.gifts += 1
+
+
+def _super_chat(w: _Window, msg: Danmaku) -> None:
+    w.sc_price += msg['data']['price']
+    w.sc += 1
+
+
+# cmd -> (the event's ts, how it adds to a window)
+_HANDLERS: dict[str, tuple[Extractor, Callable[[_Window, Danmaku], None]]] = {
+    DanmakuCommand.DANMU_MSG.value: (path('info', 9, 'ts'), _danmu),
+    DanmakuCommand.INTERACT_WORD.value: (path('data', 'timestamp'), _entry),
+    DanmakuCommand.SEND_GIFT.value: (path('data', 'timestamp'), _gift),
+    DanmakuCommand.USER_TOAST_MSG.value: (path('data', 'start_time'), _guard),
+    DanmakuCommand.USER_VIRTUAL_MVP.value: (path('data', 'timestamp'), _mvp),
+    DanmakuCommand.SUPER_CHAT_MESSAGE.value: (path('data', 'ts'), _super_chat),
+}
+
+
+class RollupListener(DanmakuListener):
+    """Per room, per minute aggregates of the events passing `Packer`.
+
+    A minute is put to `buffer` as one row once it is `grace` seconds over,
+    so dashboards don't have to scan the raw tables. Events arriving later
+    than that make another row for the same minute, which the table adds
+    up, see `ROLLUP_UPSERT`.
+    """
+
+    commands = frozenset(_HANDLERS)
+
+    def __init__(
+        self,
+        buffer: RowBuffer,
+        grace: float = 90,
+        interval: float = 15,
+        precision: int = 10,
+    ) -> None:
+        self.buffer = buffer
+        self.grace = grace
+        self.interval = interval
+        self.precision = precision
+        self._windows: dict[tuple[int, int], _Window] = {}
+        self.errors = 0
+
+    async def on_danmaku_received(self, danmu: Danmaku) -> None:
+        self._add(danmu['liverid'], danmu)
+
+    async def on_danmaku_batch(self, liverid: int, danmus: list[Danmaku]) -> None:
+        for danmu in danmus:
+            self._add(liverid, danmu)
+
+    def _add(self, liverid: int, msg: Danmaku) -> None:
+        cmd = msg['cmd']
+        if (handler := _HANDLERS.get(cmd)) is None:
+            if (handler := _HANDLERS.get(cmd.partition(':')[0])) is None:
+                return
+        get_ts, add = handler
+        try:
+            key = (liverid, int(get_ts(msg)) // 60 * 60)
+            if (window := self._windows.get(key)) is None:
+                window = self._windows[key] = _Window(self.precision)
+            add(window, msg)
+        except (KeyError, IndexError, TypeError, ValueError):
+            self.errors += 1
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush(time.time() - self.grace)
+
+    def flush(self, before: float = float('inf')) -> int:
+        """Put every minute over by `before` to the buffer."""
+        done = [key for key in self._windows if key[1] + 60 <= before]
+        for key in done:
+            window = self._windows.pop(key)
+            self.buffer.put_nowait(self._row(key, window))
+        return len(done)
+
+    @staticmethod
+    def _row(key: tuple[int, int], w: _Window) -> dict[str, Any]:
+        liverid, minute = key
+        return {
+            'ts': minute,
+            'liverid': liverid,
+            'danmaku': w.danmaku,
+            'senders': w.senders.count(),
+            'entries': w.entries,
+            'gifts': w.gifts,
+            'gift_cost': round(w.gift_cost, 1),
+            'sc': w.sc,
+            'sc_price': round(w.sc_price, 1),
+        }
+
+    def stats(self) -> dict[str, Any]:
+        return {'open_windows': len(self._windows), 'errors': self.errors}
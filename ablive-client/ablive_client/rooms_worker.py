@@ -1,11 +1,24 @@
 import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
 import aiohttp
 from tenacity import retry, stop_after_attempt, stop_after_delay
 
-from .blrec import DanmakuClient, DanmakuListener
+from .blrec import (
+    DanmakuClient,
+    DanmakuListener,
+    DanmuInfoService,
+    FrameDecoder,
+    HeartbeatWheel,
+    ReconnectGovernor,
+    TokenBucket,
+)
 from .blrec.event_emitter import EventEmitter
+from .handoff import Handoffs
+from .snapshot import Snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +30,13 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
         api_key: str,
         server_url: str,
         add_room_interval: float = 0.05,
+        onboard_concurrency: int = 50,
+        decoder: Optional[FrameDecoder] = None,
+        governor: Optional[ReconnectGovernor] = None,
+        danmu_info_service: Optional[DanmuInfoService] = None,
+        snapshot: Optional[Snapshot] = None,
+        snapshot_interval: float = 30,
+        handoffs: Optional[Handoffs] = None,
     ):
         super().__init__()
         self.worker_id = ''
@@ -24,8 +44,32 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
         self.REG_DETAIL = {'detail': detail}
         self.SERVER_URL = server_url
         self.ADD_ROOM_INTERVAL = add_room_interval
-        self.async_sem = asyncio.Semaphore(200)
+        # rooms handshaking at once, and how fast new ones may begin (an
+        # interval of 0 is no limit)
+        self._onboard_sem = asyncio.Semaphore(onboard_concurrency)
+        self._onboard_bucket = (
+            TokenBucket(1 / add_room_interval, onboard_concurrency)
+            if add_room_interval > 0 else None
+        )
         self._packers: set[DanmakuListener] = set()
+        self.decoder = decoder or FrameDecoder.shared()
+        self.heartbeat = HeartbeatWheel.shared()
+        self.governor = governor or ReconnectGovernor.shared()
+        self.danmu_info_service = danmu_info_service or DanmuInfoService.shared()
+        # set once the rooms from the server are started, see main.py
+        self.ready = asyncio.Event()
+        self.bili_session: Optional[aiohttp.ClientSession] = None
+        self.ablive_session: Optional[aiohttp.ClientSession] = None
+        # kept across re-registrations, only `close` ends the rooms
+        self._renew_states()
+        # what a restarted worker resumes from, see `_restore`
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        self._restored = False
+        self._saved_at = 0.0
+        self._closing = False
+        # rooms moving between workers, see `_follow_handoffs`
+        self.handoffs = handoffs
 
     def add_packer(self, packer: DanmakuListener):
         self._packers.add(packer)
@@ -34,15 +78,28 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
         self.rooms = set()
         self._tasks = set()
         self.dc_dict: dict[int, DanmakuClient] = {}
+        self._starting: dict[int, asyncio.Task] = {}
         self._adjusting = 0
+        # of the last adjustment, posted to the server with the heartbeats
+        self.progress = dict.fromkeys(
+            ('adding', 'removing', 'started', 'failed', 'removed'), 0
+        )
+        self._report = False
+        # handed over rooms connected or let go since the last report
+        self._connected_ids: list[int] = []
+        self._released_ids: list[int] = []
+        self._releasing: set[int] = set()
 
     @retry(reraise=True, stop=stop_after_attempt(2))
-    async def _worker_reg(self) -> None:
-        self._renew_states()
+    async def _worker_reg(self, rooms: set[tuple[int, int]]) -> None:
         async with self.ablive_session.post(
             self.SERVER_URL + '/reg',
             headers=self.REQUEST_HEADER,
             params=self.REG_DETAIL,
+            # asks to be taken back as what we were, rooms included
+            json={
+                'worker_id': self.worker_id, 'rooms': sorted(rooms)
+            } if self.worker_id else None,
         ) as r:
             if r.status == 401:
                 raise Exception('[reg] auth failed')
@@ -54,13 +111,31 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
 
     @retry(reraise=True, stop=stop_after_delay(60))
     async def _heartbeat(self):
-        async with self.ablive_session.request(
-            'post' if self._adjusting else 'get',
-            self.SERVER_URL + f'/{self.worker_id}',
-            headers=self.REQUEST_HEADER,
-        ) as r:
+        connected = self._connected_ids[:]
+        released = self._released_ids[:]
+        if self._adjusting or self._report or connected or released:
+            # the last one after an adjustment carries its final numbers
+            self._report = bool(self._adjusting)
+            request = self.ablive_session.post(
+                self.SERVER_URL + f'/{self.worker_id}',
+                headers=self.REQUEST_HEADER,
+                json={
+                    **self.progress,
+                    'connected_ids': connected,
+                    'released_ids': released,
+                },
+            )
+        else:
+            request = self.ablive_session.get(
+                self.SERVER_URL + f'/{self.worker_id}',
+                headers=self.REQUEST_HEADER,
+            )
+        async with request as r:
             resp = await r.json()
-            return resp
+        # reported, the ones added meanwhile go with the next
+        del self._connected_ids[:len(connected)]
+        del self._released_ids[:len(released)]
+        return resp
 
     def compare_rooms(self, rooms: set[tuple[int, int]]):
         rooms_diff = {
@@ -71,21 +146,34 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
 
     async def _adjust_rooms(self, rooms: list[list[int]]):
         self._adjusting = 1
-        rooms_ = {tuple(room) for room in rooms}
+        self._report = True
+        # a list sent before the server heard of a release still has the
+        # room, it is not taken back
+        released = set(self._released_ids)
+        rooms_ = {tuple(room) for room in rooms if room[0] not in released}
         rooms_diff = self.compare_rooms(rooms_)
+        self.progress = {
+            'adding': len(rooms_diff['inc']),
+            'removing': len(rooms_diff['dec']),
+            'started': 0,
+            'failed': 0,
+            'removed': 0,
+        }
 
         try:
-            for room in rooms_diff['dec']:
-                await self.remove_room(room)
-            await asyncio.sleep(1)
-
-            for room in rooms_diff['inc']:
-                await self.add_room(room)
-                await asyncio.sleep(self.ADD_ROOM_INTERVAL)
+            # removals don't wait for the additions, nor these for each other
+            await asyncio.gather(
+                *(self.remove_room(room) for room in rooms_diff['dec']),
+                *(self.add_room(room) for room in rooms_diff['inc']),
+            )
 
             logger.info(
-                f"rooms + {len(rooms_diff['inc'])} - {len(rooms_diff['dec'])}"
+                f"rooms + {self.progress['started']} - {self.progress['removed']}"
+                f" ({self.progress['failed']} failed)"
             )
+            self.ready.set()
+            if not self._closing:
+                self._save_snapshot()
 
         except Exception as e:
             raise e
@@ -103,37 +191,112 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
             logger.error(f"worker async task error: {e}")
         self._tasks.discard(fut)
 
-    async def run(self):
-        self.bili_session = aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(limit=0)
-        )
-        self.ablive_session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=5),
-            connector=aiohttp.TCPConnector(ssl=False)
-        )
+    def _open_sessions(self) -> None:
+        if self.bili_session is None or self.bili_session.closed:
+            self.bili_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0)
+            )
+        if self.ablive_session is None or self.ablive_session.closed:
+            self.ablive_session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=5),
+                connector=aiohttp.TCPConnector(ssl=False)
+            )
+
+    def _restore(self) -> list[list[int]]:
+        """Starts the rooms of the previous process, if it left a snapshot,
+        without waiting for the server to hand them out again."""
+        self._restored = True
+        if self.snapshot is None or (state := self.snapshot.load()) is None:
+            return []
+        self.worker_id = state['worker_id']
+        self.danmu_info_service.load(state['danmu_info'])
+        logger.info(f"resuming {len(state['rooms'])} rooms as {self.worker_id}")
+        self._add_async_task(self._adjust_rooms(state['rooms']))
+        return state['rooms']
 
+    def _save_snapshot(self) -> None:
+        if self.snapshot is None or not self.worker_id:
+            return
         try:
-            await self._worker_reg()
-
-            while True:
-                resp = await self._heartbeat()
-                if resp['ok']:
-                    if 'rooms' in resp:
-                        self._add_async_task(
-                            self._adjust_rooms(resp['rooms'])
-                        )
-                    await asyncio.sleep(resp['interval'])
-                else:
-                    raise Exception('heartbeat error')
+            self.snapshot.save({
+                'worker_id': self.worker_id,
+                'rooms': sorted(self.rooms),
+                'danmu_info': self.danmu_info_service.dump(),
+            })
+        except OSError as e:
+            logger.error(f'failed to save the snapshot: {e!r}')
+        self._saved_at = time.monotonic()
 
-        except Exception as e:
-            raise e
+    async def run(self):
+        # a failure here only concerns the server, the rooms keep running
+        # and the room list after registering again is applied as a diff
+        self._open_sessions()
+        rooms = self.rooms.copy()
+        if not self._restored:
+            rooms.update(tuple(room) for room in self._restore())
+        await self._worker_reg(rooms)
 
-        finally:
-            await self._adjust_rooms([])
-            await self.bili_session.close()
-            await self.ablive_session.close()
-            await asyncio.sleep(3)
+        while True:
+            resp = await self._heartbeat()
+            if resp['ok']:
+                # before the rooms, a room taken over must not start unfiltered
+                self._follow_handoffs(resp)
+                if 'rooms' in resp:
+                    self._add_async_task(
+                        self._adjust_rooms(resp['rooms'])
+                    )
+                elif not self._adjusting:
+                    # nothing to start
+                    self.ready.set()
+                if time.monotonic() - self._saved_at >= self.snapshot_interval:
+                    self._save_snapshot()
+                await asyncio.sleep(resp['interval'])
+            else:
+                raise Exception('heartbeat error')
+
+    def _follow_handoffs(self, resp: dict) -> None:
+        if self.handoffs is None or 'handoff_in' not in resp:
+            return
+        incoming, outgoing = set(), set()
+        for liverid, cutover in resp['handoff_in']:
+            incoming.add(liverid)
+            self.handoffs.receive(liverid, cutover)
+            if cutover is None and liverid in self.dc_dict \
+                    and liverid not in self._starting:
+                # running already, e.g. resumed from the snapshot
+                self._connected_ids.append(liverid)
+
+        for liverid, cutover, release_at in resp['handoff_out']:
+            outgoing.add(liverid)
+            if liverid not in self.dc_dict:
+                # let go already, listed until the server hears of it
+                continue
+            self.handoffs.release(liverid, cutover)
+            if release_at is not None and liverid not in self._releasing:
+                self._releasing.add(liverid)
+                self._add_async_task(self._release(liverid, release_at))
+        self.handoffs.prune(incoming, outgoing, self.dc_dict)
+
+    async def _release(self, liverid: int, release_at: float):
+        # the other worker has the room's events from the cutover on, these
+        # seconds let the ones before it still arrive here
+        await asyncio.sleep(max(0.0, release_at - time.time()))
+        self._releasing.discard(liverid)
+        for room in self.rooms:
+            if room[0] == liverid:
+                await self.remove_room(room)
+                logger.info(f'[{liverid}] handed over')
+                break
+
+    async def close(self):
+        # the snapshot keeps the rooms for the next process
+        self._closing = True
+        await self._adjust_rooms([])
+        for session in (self.bili_session, self.ablive_session):
+            if session is not None:
+                await session.close()
+        await self.danmu_info_service.close()
+        await asyncio.sleep(3)
 
     async def add_room(self, room: tuple[int, int]):
         liverid, room_id = room
@@ -141,19 +304,59 @@ class RoomsWorker(EventEmitter[DanmakuListener]):
             self.bili_session,
             liverid=liverid,
             room_id=room_id,
+            decoder=self.decoder,
+            heartbeat=self.heartbeat,
+            governor=self.governor,
+            danmu_info_service=self.danmu_info_service,
         )
         self.rooms.add(room)
         for packer in self._packers:
             dc.add_listener(packer)
         self.dc_dict[liverid] = dc
-        # await dc._do_start()
-        async with self.async_sem:
-            self._add_async_task(dc._do_start())
+
+        task = asyncio.create_task(self._start_room(dc))
+        self._starting[liverid] = task
+        await asyncio.wait([task])
+        if self._starting.get(liverid) is task:
+            del self._starting[liverid]
+        if task.cancelled():
+            # removed while still connecting
+            return
+        if e := task.exception():
+            logger.error(f'[{liverid}] failed to start: {e!r}')
+            self.progress['failed'] += 1
+            # dropped, so the next room list brings it in again
+            self.rooms.discard(room)
+            self.dc_dict.pop(liverid, None)
+            await dc._do_stop()
+        else:
+            self.progress['started'] += 1
+            if self.handoffs is not None and self.handoffs.awaiting(liverid):
+                self._connected_ids.append(liverid)
+
+    async def _start_room(self, dc: DanmakuClient):
+        # a room whose hosts are down keeps retrying, but not in a slot
+        await dc._do_start(self._onboarding())
+
+    @asynccontextmanager
+    async def _onboarding(self):
+        if self._onboard_bucket is not None:
+            await self._onboard_bucket.acquire()
+        async with self._onboard_sem:
+            yield
 
     async def remove_room(self, room: tuple[int, int]):
         liverid = room[0]
         self.rooms.discard(room)
-        dc = self.dc_dict.pop(liverid)
-        # await dc._do_stop()
-        async with self.async_sem:
-            self._add_async_task(dc._do_stop())
+        if (dc := self.dc_dict.pop(liverid, None)) is None:
+            # released by a handoff meanwhile
+            return
+        if (task := self._starting.pop(liverid, None)) is not None:
+            task.cancel()
+            await asyncio.wait([task])
+        await dc._do_stop()
+        self.progress['removed'] += 1
+        if self.handoffs is not None:
+            if self.handoffs.side(liverid) == Handoffs.OUT:
+                self._released_ids.append(liverid)
+            self.handoffs.discard(liverid)
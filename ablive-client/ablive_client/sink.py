@@ -0,0 +1,150 @@
+# Used by packer.Packer only
+
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, ClassVar
+
+from .buffer import RowBuffer
+from .metrics import Histogram
+from .spool import Acks
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(ABC):
+    """Drains one schema's `RowBuffer` into a store.
+
+    A batch is taken once `flush_rows` rows or `flush_bytes` bytes are
+    buffered, or the oldest row is `flush_max_age` seconds old, and up to
+    `max_inflight` batches are written at once. Batches failing with one
+    of `retryable` go back to the buffer. A store that can't be opened,
+    e.g. MySQL down at start, is retried with a backoff up to
+    `OPEN_BACKOFF_CAP`.
+    """
+
+    kind: ClassVar[str]
+    retryable: ClassVar[tuple[type[BaseException], ...]] = ()
+    OPEN_BACKOFF_CAP: ClassVar[float] = 60
+    CLOSE_TIMEOUT: ClassVar[float] = 10
+
+    def __init__(
+        self,
+        buffer: RowBuffer,
+        name: str,
+        flush_rows: int = 5000,
+        flush_bytes: int = 4 << 20,
+        flush_max_age: float = 5,
+        max_inflight: int = 2,
+        retry_delay: float = 5,
+    ) -> None:
+        self.buffer = buffer
+        self.buffer.flush_rows = flush_rows
+        self.buffer.flush_bytes = flush_bytes
+        self.schema_name = name
+        self.flush_rows = flush_rows
+        self.flush_max_age = flush_max_age
+        self.retry_delay = retry_delay
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._flushes: set[asyncio.Task] = set()
+        self._opened = False
+        # seconds from the event's own `ts` to the row being written
+        self.latency = Histogram((1, 2, 5, 10, 30, 60, 120, 300, 900, 3600))
+        # seconds a `write` takes
+        self.write_time = Histogram((0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30))
+
+    async def open(self) -> None:
+        pass
+
+    @abstractmethod
+    async def write(self, rows: list[dict[str, Any]]) -> None:
+        ...
+
+    async def close(self) -> None:
+        """Waits for the batches being written; override to finish up
+        what the store keeps open."""
+        if self._flushes:
+            await asyncio.wait(self._flushes, timeout=self.CLOSE_TIMEOUT)
+
+    def committed(self, acks: Acks) -> None:
+        """Called once a batch is written; override if it isn't durable
+        until later."""
+        self.buffer.ack(acks)
+
+    async def run(self) -> None:
+        # run again after a crash, see Packer, without opening again
+        if not self._opened:
+            await self._open()
+        while True:
+            await self._wait_flush()
+
+            # the next batch keeps accumulating while this one is written
+            await self._inflight.acquire()
+            rows, acks = self.buffer.drain(self.flush_rows)
+            task = asyncio.create_task(self._flush(rows, acks))
+            self._flushes.add(task)
+            task.add_done_callback(self._flush_done)
+
+    async def _open(self) -> None:
+        delay = self.retry_delay
+        while True:
+            try:
+                await self.open()
+            except Exception as e:
+                logger.error(
+                    f'{self.buffer.name} failed to open, retry in {delay}s: {e!r}'
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.OPEN_BACKOFF_CAP)
+            else:
+                self._opened = True
+                return
+
+    async def _wait_flush(self) -> None:
+        # until enough rows/bytes are buffered or the oldest one is too old
+        while True:
+            age = self.buffer.age()
+            if age >= self.flush_max_age:
+                return
+            try:
+                await asyncio.wait_for(
+                    self.buffer.wait_ready(), self.flush_max_age - age
+                )
+            except asyncio.TimeoutError:
+                continue
+            else:
+                return
+
+    async def _flush(self, rows: list[dict[str, Any]], acks: Acks) -> None:
+        t0 = time.perf_counter()
+        try:
+            await self.write(rows)
+        except self.retryable as e:
+            logger.error(f'{self.buffer.name} requeued {len(rows)} rows: {e!r}')
+            self.buffer.requeue(rows, acks)
+            # keeps the inflight slot, so a dead store isn't hammered
+            await asyncio.sleep(self.retry_delay)
+        except Exception:
+            # bad rows would fail the same way when replayed
+            self.buffer.ack(acks)
+            raise
+        else:
+            self.write_time.observe(time.perf_counter() - t0)
+            self.committed(acks)
+            now = time.time()
+            self.latency.observe_many(now - row['ts'] for row in rows)
+            logger.info(f"{self.buffer.name} + {len(rows)}")
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flushes.discard(task)
+        self._inflight.release()
+        if not task.cancelled() and (e := task.exception()):
+            logger.error(f'{self.buffer.name} flush failed: {e!r}')
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.buffer.stats(),
+            'latency': self.latency.cumulative(),
+            'write_time': self.write_time.cumulative(),
+        }
@@ -0,0 +1,44 @@
+# Used by rooms_worker.RoomsWorker only
+
+import logging
+import os
+import time
+from typing import Any, Optional
+
+import orjson as json
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """A worker's identity, rooms and danmu info cache in one local file.
+
+    Written whole to a temporary file and moved into place, so a crash
+    leaves either the previous snapshot or the new one. Snapshots older
+    than `max_age` are ignored, their rooms were handed out again by then.
+    """
+
+    def __init__(self, path: str, max_age: float = 600) -> None:
+        self.path = path
+        self.max_age = max_age
+
+    def load(self) -> Optional[dict[str, Any]]:
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f'unreadable snapshot {self.path}: {e!r}')
+            return None
+        if time.time() - state['saved'] > self.max_age:
+            logger.info(f'snapshot {self.path} too old, starting afresh')
+            return None
+        return state
+
+    def save(self, state: dict[str, Any]) -> None:
+        tmp_path = self.path + '.tmp'
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps({**state, 'saved': time.time()}))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,211 @@
+# Used by buffer.RowBuffer only
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, BinaryIO, Final, Iterator, Optional
+
+import orjson as json
+
+logger = logging.getLogger(__name__)
+
+Acks = dict[int, int]
+# segment, byte offset
+Cursor = tuple[int, int]
+
+
+class Spool:
+    """Append-only write-ahead log of the rows of one buffer.
+
+    Rows are appended to numbered segment files before they are queued for
+    MySQL. A segment is removed once it is sealed and every row in it was
+    acknowledged after commit; whatever is left on disk is replayed on the
+    next start. Writes are fsync'ed in batches every `fsync_interval`.
+
+    Delivery is at-least-once: rows of a partially acknowledged segment are
+    replayed in full, which is why segments rotate by age as well as size.
+    """
+
+    SEGMENT_BYTES: Final[int] = 16 << 20
+    SEGMENT_SECONDS: Final[float] = 10
+    FSYNC_INTERVAL: Final[float] = 0.2
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = SEGMENT_BYTES,
+        segment_seconds: float = SEGMENT_SECONDS,
+        fsync_interval: float = FSYNC_INTERVAL,
+    ) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._unacked: dict[int, int] = {}
+        self._seq = max(self._segments(), default=0)
+        self._file: Optional[BinaryIO] = None
+        self._opened_at = 0.0
+        self._dirty = False
+        self.appended = 0
+        self.fsyncs = 0
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f'{seq:012d}.seg')
+
+    def _segments(self) -> list[int]:
+        return sorted(
+            int(name[:-4]) for name in os.listdir(self.directory)
+            if name.endswith('.seg')
+        )
+
+    def replay(self) -> Iterator[tuple[int, int]]:
+        """Segments left over from the previous run with their row counts,
+        the rows themselves are `read` as they are needed."""
+        for seq in self._segments():
+            if seq in self._unacked or seq == self._seq and self._file:
+                continue
+            if count := _count_rows(self._path(seq)):
+                self._unacked[seq] = count
+                yield seq, count
+            else:
+                os.remove(self._path(seq))
+
+    def tell(self) -> Cursor:
+        """Where the next appended row goes."""
+        if self._file is None:
+            return self._seq + 1, 0
+        return self._seq, self._file.tell()
+
+    def read(
+        self, cursor: Cursor, n: int
+    ) -> tuple[list[dict[str, Any]], list[list[int]], Cursor]:
+        """Up to `n` rows from `cursor` on, with the [segment, count] runs
+        they belong to and where the next read starts. Fewer only once it
+        caught up with the appends."""
+        if self._file is not None:
+            self._file.flush()
+        seq, offset = cursor
+        rows: list[dict[str, Any]] = []
+        runs: list[list[int]] = []
+        while True:
+            if seq in self._unacked:
+                count = broken = 0
+                with open(self._path(seq), 'rb') as f:
+                    f.seek(offset)
+                    while len(rows) < n and (line := f.readline()):
+                        try:
+                            rows.append(json.loads(line))
+                            count += 1
+                        except json.JSONDecodeError:
+                            logger.warning(f'skipped a broken line in {f.name}')
+                            broken += 1
+                    offset = f.tell()
+                if count:
+                    runs.append([seq, count])
+                if broken:
+                    self._settle(seq, broken)
+            if len(rows) >= n or seq >= self._seq:
+                break
+            later = [k for k in self._unacked if k > seq]
+            if not later:
+                break
+            seq, offset = min(later), 0
+        return rows, runs, (seq, offset)
+
+    def append(self, row: dict[str, Any]) -> int:
+        if self._file is None or self._should_rotate():
+            self._rotate()
+        assert self._file is not None
+        self._file.write(json.dumps(row) + b'\n')
+        self._unacked[self._seq] += 1
+        self._dirty = True
+        self.appended += 1
+        return self._seq
+
+    def ack(self, acks: Acks) -> None:
+        for seq, count in acks.items():
+            self._settle(seq, count)
+
+    def _settle(self, seq: int, count: int) -> None:
+        left = self._unacked[seq] - count
+        if left > 0 or seq == self._seq and self._file is not None:
+            self._unacked[seq] = left
+        else:
+            del self._unacked[seq]
+            os.remove(self._path(seq))
+
+    def _should_rotate(self) -> bool:
+        assert self._file is not None
+        return (
+            self._file.tell() >= self.segment_bytes
+            or time.monotonic() - self._opened_at >= self.segment_seconds
+        )
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            if not self._unacked[self._seq]:
+                del self._unacked[self._seq]
+                os.remove(self._path(self._seq))
+        self._seq += 1
+        self._file = open(self._path(self._seq), 'ab')
+        self._opened_at = time.monotonic()
+        self._unacked[self._seq] = 0
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            if not self._dirty or self._file is None:
+                continue
+            self._dirty = False
+            try:
+                self._file.flush()
+                # `append` may rotate and close the segment meanwhile, the
+                # duplicate keeps the descriptor valid until the sync is done
+                fd = os.dup(self._file.fileno())
+                try:
+                    await loop.run_in_executor(None, os.fsync, fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.error(f'spool fsync failed: {e!r}')
+                self._dirty = True
+                continue
+            self.fsyncs += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'segments': len(self._unacked),
+            'unacked': sum(self._unacked.values()),
+            'appended': self.appended,
+            'fsyncs': self.fsyncs,
+        }
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+def _count_rows(path: str) -> int:
+    """Counts the rows of a segment without loading them, and cuts off a
+    torn write at its tail."""
+    count = end = pos = 0
+    with open(path, 'r+b') as f:
+        while chunk := f.read(1 << 20):
+            if n := chunk.count(b'\n'):
+                count += n
+                end = pos + chunk.rindex(b'\n') + 1
+            pos += len(chunk)
+        if end < pos:
+            logger.warning(f'cut a torn write off {path}')
+            f.truncate(end)
+    return count
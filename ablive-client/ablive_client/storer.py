@@ -3,94 +3,165 @@
 import asyncio
 import logging
 import time
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 
 import sqlalchemy as sa
-import databases
+from asyncmy.errors import InterfaceError, OperationalError
 
-logger = logging.getLogger(__name__)
+from . import bulk
+from .buffer import RowBuffer
+from .database import ConnectionManager
+from .partition import TimePartitioner
+from .sink import Sink
+from .uname import UnameDirectory
 
+logger = logging.getLogger(__name__)
 
-def get_date():
-    return time.strftime("%Y_%m_%d", time.localtime())
 
+def _fact_table(table: sa.Table) -> sa.Table:
+    # `table` without `uname`
+    return sa.Table(
+        f'{table.name}_n',
+        sa.MetaData(),
+        *[
+            sa.Column(
+                c.name,
+                c.type,
+                nullable=c.nullable,
+                primary_key=c.primary_key,
+                autoincrement=c.autoincrement,
+            )
+            for c in table.columns if c.name != 'uname'
+        ],
+        schema=table.schema,
+        **table.kwargs,
+    )
 
-def date2ts(date_):
-    return int(time.mktime(time.strptime(date_, "%Y_%m_%d")))
 
+class Storer(Sink):
+    kind = 'mysql'
+    # MySQL being away rather than the rows being bad, worth retrying
+    retryable = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
 
-class Storer:
     def __init__(
         self,
-        mysql_dsn: str,
+        db: ConnectionManager,
         table_gen: Callable[[str], sa.Table],
-        buffer: asyncio.Queue,
+        buffer: RowBuffer,
         name: str,
+        insert_strategy: str = bulk.EXECUTE_MANY,
+        chunk_size: int = 1000,
+        precreate_ahead: float = 12 * 3600,
+        precreate_interval: float = 600,
+        max_tables: int = 8,
+        unames: Optional[UnameDirectory] = None,
+        on_duplicate: str = '',
+        **options: Any,
     ):
-        self.mysql_dsn = mysql_dsn
-        self.buffer = buffer
+        if insert_strategy not in bulk.STRATEGIES:
+            raise ValueError(f'unknown insert strategy: {insert_strategy}')
+        if on_duplicate and insert_strategy != bulk.MULTIROW:
+            raise ValueError('on_duplicate needs the multirow insert strategy')
+        super().__init__(buffer, name, **options)
+        self.db = db
+        self.insert_strategy = insert_strategy
+        self.chunk_size = chunk_size
+        # for tables keyed by more than `_id`, see bulk.insert_multirow
+        self.on_duplicate = on_duplicate
         self._table_gen = table_gen
-        self.schema_name = name
+        # normalized: `uname` lives in `unames`, see _new_table
+        self.unames = unames
         self._engine: sa.engine.Engine
-        self._table: sa.Table
-
-    async def run(self):
+        # day tables known to exist, by name
+        self.partitioner = TimePartitioner()
+        self._tables: dict[str, sa.Table] = {}
+        self._creating: dict[str, asyncio.Task] = {}
+        self.max_tables = max_tables
+        self.precreate_ahead = precreate_ahead
+        self.precreate_interval = precreate_interval
+
+    async def open(self):
         await self.init_db()
-        try:
-            while True:
-                await asyncio.gather(
-                    self._store(),
-                    asyncio.sleep(5),
-                )
-        except Exception as e:
-            raise e
+        self._precreate_task = asyncio.create_task(self._precreate())
 
     async def init_db(self):
-        self._db_instance = databases.Database(
-            self.mysql_dsn + self.schema_name,
+        await self.db.connect()
+        if self.unames is not None:
+            await self.unames.open()
+        await self._get_table(self.partitioner.name(time.time()))
+
+    async def _precreate(self):
+        # tomorrow's table exists well before midnight, so the first rows
+        # of the day don't wait on DDL
+        while True:
+            for ts in (time.time(), time.time() + self.precreate_ahead):
+                try:
+                    await self._get_table(self.partitioner.name(ts))
+                except Exception as e:
+                    logger.error(f'{self.schema_name} precreate failed: {e!r}')
+            await asyncio.sleep(self.precreate_interval)
+
+    async def _get_table(self, name: str) -> sa.Table:
+        if (table := self._tables.get(name)) is not None:
+            return table
+        # one CREATE per name, however many flushes ask at once
+        if (task := self._creating.get(name)) is None:
+            task = asyncio.create_task(self._new_table(name))
+            self._creating[name] = task
+            task.add_done_callback(lambda _: self._creating.pop(name, None))
+        return await asyncio.shield(task)
+
+    async def _new_table(self, name: str) -> sa.Table:
+        # qualified, the pooled connections have no default schema
+        table = self._table_gen(name).to_metadata(
+            sa.MetaData(), schema=self.schema_name
         )
-        await self._db_instance.connect()
-        await self._new_table()
-
-    async def _new_table(self):
-        table = self._table_gen(get_date())
-        self._table = table
-
+        view = None
+        if self.unames is not None:
+            # rows go to `<day>_n`, `<day>` becomes a view with the names
+            view, table = table, _fact_table(table)
         query = str(
             sa.schema.CreateTable(table, if_not_exists=True).compile(
                 dialect=sa.dialects.mysql.dialect()
             )
         )
-        await self._db_instance.execute(query)
-
-    async def _store(self) -> None:
-        time_near = int(time.time()) % 86400
-        if (time_near < 4) or (time_near > (86400 - 4)):
-            logger.info('time is near 00:00, skip a round')
-            return
-
-        buffer = self.buffer
-        rows_cnt = buffer.qsize()
-        rows = [buffer.get_nowait() for _ in range(rows_cnt)]
-
-        if get_date() == self._table.name:
-            await self._insert(rows)
-        else:
-            min_ts = date2ts(self._table.name) + 86400
-            prev_rows = []
-            next_rows = []
-            for row in rows:
-                if row['ts'] < min_ts:
-                    prev_rows.append(row)
-                else:
-                    next_rows.append(row)
-            await self._insert(prev_rows)
-            await self._new_table()
-            await self._insert(next_rows)
-
-        logger.info(f"{self.schema_name} + {rows_cnt}")
-
-    async def _insert(self, rows: list[dict[str, Any]]):
+        await self.db.execute(query)
+        if view is not None:
+            try:
+                await self.db.execute(self.unames.view_sql(view, table))
+            except Exception as e:
+                # e.g. a plain `<day>` table from before the switch
+                logger.warning(f'{self.schema_name} no view {name}: {e!r}')
+
+        self._tables[name] = table
+        if len(self._tables) > self.max_tables:
+            # names sort by date, forget the oldest
+            del self._tables[min(self._tables)]
+        return table
+
+    async def write(self, rows: list[dict[str, Any]]) -> None:
+        if self.unames is not None:
+            await self.unames.observe(rows)
+        for name, part in self.partitioner.group(rows).items():
+            await self._insert(await self._get_table(name), part)
+
+    async def _insert(self, table: sa.Table, rows: list[dict[str, Any]]):
         if not rows:
             return
-        await self._db_instance.execute_many(self._table.insert(), rows)
+        if self.insert_strategy == bulk.EXECUTE_MANY:
+            if self.unames is not None:
+                columns = bulk.insert_columns(table)
+                rows = [{c: row[c] for c in columns} for row in rows]
+            await self.db.execute_many(table.insert(), rows)
+            return
+
+        async with self.db.connection() as conn:
+            if self.insert_strategy == bulk.LOAD_DATA:
+                await bulk.insert_load_data(
+                    conn.raw_connection, table, rows, self.chunk_size
+                )
+            else:
+                await bulk.insert_multirow(
+                    conn.raw_connection, table, rows, self.chunk_size,
+                    self.on_duplicate,
+                )
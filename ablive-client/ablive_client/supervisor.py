@@ -0,0 +1,228 @@
+import logging
+import signal
+import time
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# a child gets its slot index and the end of a pipe to report on, it sends
+# READY once it carries its share of the load
+Target = Callable[[int, Connection], None]
+READY = 'ready'
+
+
+class _Slot:
+    __slots__ = (
+        'index', 'process', 'conn', 'started_at', 'ready', 'failures',
+        'restart_at',
+    )
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.process: Optional[Process] = None
+        self.conn: Optional[Connection] = None
+        self.started_at = 0.0
+        self.ready = False
+        self.failures = 0
+        self.restart_at: Optional[float] = None
+
+
+def _child_main(target: Target, index: int, conn: Connection) -> None:
+    # the parent's handlers only set its own flags
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    target(index, conn)
+
+
+class Supervisor:
+    """Runs `count` worker processes and keeps them running.
+
+    Children start one after another, each once the previous one reported
+    ready or `ready_timeout` passed. A child that exits is started again
+    after a backoff, doubling from `backoff_base` up to `backoff_cap` while
+    it keeps dying within `stable_after` seconds.
+
+    SIGHUP restarts the children one at a time, each waiting for the last
+    to be ready again, where there is one (not on Windows); SIGTERM and
+    SIGINT stop them all.
+    """
+
+    def __init__(
+        self,
+        target: Target,
+        count: int,
+        ready_timeout: float = 90,
+        backoff_base: float = 1,
+        backoff_cap: float = 60,
+        stable_after: float = 300,
+        stop_timeout: float = 30,
+    ) -> None:
+        self.target = target
+        self.ready_timeout = ready_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self.slots = [_Slot(i) for i in range(count)]
+        self.restarts = 0
+        self._stopping = False
+        self._rolling = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_rolling)
+        try:
+            for slot in self.slots:
+                if self._stopping:
+                    break
+                self._start(slot)
+                self._wait_ready(slot)
+            while not self._stopping:
+                if self._rolling:
+                    self._rolling = False
+                    self._rolling_restart()
+                self._poll(1)
+        finally:
+            self._stop_all()
+
+    def _on_stop(self, signum: int, frame: Any) -> None:
+        self._stopping = True
+
+    def _on_rolling(self, signum: int, frame: Any) -> None:
+        self._rolling = True
+
+    def _start(self, slot: _Slot) -> None:
+        parent_conn, child_conn = Pipe(duplex=False)
+        process = Process(
+            target=_child_main,
+            args=(self.target, slot.index, child_conn),
+            name=f'worker-{slot.index}',
+        )
+        process.start()
+        child_conn.close()
+        slot.process = process
+        slot.conn = parent_conn
+        slot.started_at = time.monotonic()
+        slot.ready = False
+        slot.restart_at = None
+        logger.info(f'worker {slot.index} started, pid {process.pid}')
+
+    def _wait_ready(self, slot: _Slot) -> None:
+        deadline = time.monotonic() + self.ready_timeout
+        while not slot.ready and not self._stopping:
+            if slot.process is None:
+                # died while starting, the backoff decides when it's back
+                return
+            left = deadline - time.monotonic()
+            if left <= 0:
+                logger.warning(f'worker {slot.index} not ready after '
+                               f'{self.ready_timeout}s, going on')
+                return
+            self._poll(min(left, 1))
+
+    def _poll(self, timeout: float) -> None:
+        waitables: dict[Any, tuple[_Slot, bool]] = {}
+        for slot in self.slots:
+            if slot.process is not None:
+                waitables[slot.process.sentinel] = (slot, False)
+                if slot.conn is not None:
+                    waitables[slot.conn] = (slot, True)
+
+        now = time.monotonic()
+        due = [s.restart_at for s in self.slots if s.restart_at is not None]
+        if due:
+            timeout = max(0, min(timeout, min(due) - now))
+
+        for obj in wait(list(waitables), timeout):
+            slot, is_conn = waitables[obj]
+            if is_conn:
+                self._receive(slot)
+            elif slot.process is not None:
+                self._reap(slot)
+
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.restart_at is not None and slot.restart_at <= now:
+                self.restarts += 1
+                self._start(slot)
+
+    def _receive(self, slot: _Slot) -> None:
+        assert slot.conn is not None
+        try:
+            message = slot.conn.recv()
+        except EOFError:
+            # the child is going away, its sentinel tells when
+            slot.conn = None
+            return
+        if message == READY:
+            slot.ready = True
+            logger.info(f'worker {slot.index} ready in '
+                        f'{time.monotonic() - slot.started_at:.1f}s')
+
+    def _reap(self, slot: _Slot) -> None:
+        assert slot.process is not None
+        slot.process.join()
+        code = slot.process.exitcode
+        uptime = time.monotonic() - slot.started_at
+        slot.process = None
+        if slot.conn is not None:
+            slot.conn.close()
+            slot.conn = None
+        slot.ready = False
+        if self._stopping:
+            return
+
+        slot.failures = slot.failures + 1 if uptime < self.stable_after else 1
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** (slot.failures - 1))
+        slot.restart_at = time.monotonic() + delay
+        logger.error(f'worker {slot.index} exited with {code} after '
+                     f'{uptime:.0f}s, restarting in {delay:.1f}s')
+
+    def _stop(self, slot: _Slot) -> None:
+        process = slot.process
+        if process is None:
+            return
+        process.terminate()
+        process.join(self.stop_timeout)
+        if process.is_alive():
+            logger.warning(f'worker {slot.index} ignored SIGTERM, killing it')
+            process.kill()
+            process.join()
+        slot.process = None
+        if slot.conn is not None:
+            slot.conn.close()
+            slot.conn = None
+        slot.ready = False
+
+    def _rolling_restart(self) -> None:
+        logger.info('rolling restart')
+        for slot in self.slots:
+            if self._stopping:
+                return
+            # one index at a time, its spool can't have two writers
+            self._stop(slot)
+            slot.failures = 0
+            self._start(slot)
+            self._wait_ready(slot)
+
+    def _stop_all(self) -> None:
+        for slot in self.slots:
+            if slot.process is not None:
+                slot.process.terminate()
+        for slot in self.slots:
+            slot.restart_at = None
+            self._stop(slot)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'workers': len(self.slots),
+            'alive': sum(s.process is not None for s in self.slots),
+            'ready': sum(s.ready for s in self.slots),
+            'restarts': self.restarts,
+        }
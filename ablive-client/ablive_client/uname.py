@@ -0,0 +1,125 @@
+# Used by storer.Storer only
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any
+
+import sqlalchemy as sa
+
+from . import bulk
+from .database import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# a late row doesn't overwrite the name a newer one brought in
+_UPSERT = (
+    'uname = IF(VALUES(ts) >= ts, VALUES(uname), uname), '
+    'ts = GREATEST(ts, VALUES(ts))'
+)
+
+
+def uname_table(schema: str) -> sa.Table:
+    return sa.Table(
+        'uname',
+        sa.MetaData(),
+        sa.Column('uid', sa.BigInteger, primary_key=True, autoincrement=False),
+        sa.Column('uname', sa.String(64), nullable=False),
+        sa.Column('ts', sa.Integer, nullable=False),
+        schema=schema,
+        mysql_engine='InnoDB',
+        mysql_charset='utf8mb4',
+    )
+
+
+class UnameDirectory:
+    """The `uid -> uname` dimension table of the normalized mode.
+
+    Rows are checked against an LRU of the last known name per uid and only
+    changed names are upserted, before the fact rows referring to them.
+    """
+
+    def __init__(
+        self,
+        db: ConnectionManager,
+        schema: str = 'ablive_uname',
+        cache_size: int = 500000,
+        chunk_size: int = 1000,
+    ) -> None:
+        self.db = db
+        self.table = uname_table(schema)
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self._cache: OrderedDict[int, str] = OrderedDict()
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+        self.hits = 0
+        self.upserts = 0
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._opened:
+                return
+            dialect = sa.dialects.mysql.dialect()
+            await self.db.execute(
+                str(sa.schema.CreateSchema(self.table.schema, if_not_exists=True)
+                    .compile(dialect=dialect))
+            )
+            await self.db.execute(
+                str(sa.schema.CreateTable(self.table, if_not_exists=True)
+                    .compile(dialect=dialect))
+            )
+            self._opened = True
+
+    def view_sql(self, view: sa.Table, fact: sa.Table) -> str:
+        """`view` as the join of `fact` and the names, for the readers of
+        the old tables."""
+        preparer = sa.dialects.mysql.dialect().identifier_preparer
+        columns = ', '.join(
+            'COALESCE(n.`uname`, \'\') AS `uname`' if c.name == 'uname'
+            else f'f.{preparer.quote(c.name)}'
+            for c in view.columns
+        )
+        return (
+            f'CREATE OR REPLACE VIEW {preparer.format_table(view)} AS'
+            f' SELECT {columns} FROM {preparer.format_table(fact)} AS f'
+            f' LEFT JOIN {preparer.format_table(self.table)} AS n'
+            f' ON n.`uid` = f.`uid`'
+        )
+
+    async def observe(self, rows: list[dict[str, Any]]) -> None:
+        cache = self._cache
+        changed: dict[int, dict[str, Any]] = {}
+        for row in rows:
+            uid = row['uid']
+            if cache.get(uid) == row['uname']:
+                cache.move_to_end(uid)
+                self.hits += 1
+            else:
+                changed[uid] = row
+        if not changed:
+            return
+
+        values = [
+            {'uid': uid, 'uname': row['uname'], 'ts': row['ts']}
+            for uid, row in changed.items()
+        ]
+        async with self.db.connection() as conn:
+            await bulk.insert_multirow(
+                conn.raw_connection, self.table, values, self.chunk_size, _UPSERT
+            )
+        self.upserts += len(values)
+
+        # only once stored, so a failed batch is upserted again
+        for uid, row in changed.items():
+            cache[uid] = row['uname']
+            cache.move_to_end(uid)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'upserts': self.upserts,
+        }
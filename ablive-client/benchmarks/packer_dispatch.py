@@ -0,0 +1,146 @@
+"""Per-message cost of Packer's command dispatch.
+
+    python -m benchmarks.packer_dispatch [packets.jsonl]
+
+`packets.jsonl` holds one decoded packet per line as received from the
+websocket. Without it a synthetic mix of the handled commands plus the
+usual noise is used.
+"""
+import sys
+import time
+from collections import defaultdict
+
+import orjson as json
+
+from ablive_client.events import EVENT_ROUTES, Dispatcher
+
+
+def legacy_pack(_liverid, msg, emit):
+    # Packer.on_danmaku_received before the dispatch table
+    cmd = msg['cmd']
+    liverid = msg['liverid']
+    if cmd.startswith('DANMU_MSG'):
+        info = msg['info']
+        text = info[1]
+        if isinstance(info[0][13], dict):
+            text = f'[{text}]'
+        emit('ablive_dm', {
+            'ts': info[9]['ts'], 'uid': info[2][0], 'uname': info[2][1],
+            'text': text, 'liverid': liverid,
+        })
+    elif cmd == 'INTERACT_WORD':
+        d = msg['data']
+        emit('ablive_en', {
+            'ts': d['timestamp'], 'uid': d['uid'], 'uname': d['uname'],
+            'liverid': liverid,
+        })
+    elif cmd == 'SEND_GIFT':
+        d = msg['data']
+        if not d['discount_price']:
+            return
+        gift_info = f'{d["giftName"]}x{d["num"]}'
+        gift_cost = (d['discount_price'] * d['num']) / 1000
+        if d['blind_gift']:
+            gift_info = '[%s]%s' % (d['blind_gift']['original_gift_name'], gift_info)
+            gift_cost = d['total_coin'] / 1000
+        emit('ablive_gf', {
+            'ts': d['timestamp'], 'uid': d['uid'], 'uname': d['uname'],
+            'liverid': liverid, 'gift_info': gift_info, 'gift_cost': gift_cost,
+        })
+    elif cmd == 'USER_TOAST_MSG':
+        d = msg['data']
+        emit('ablive_gf', {
+            'ts': d['start_time'], 'uid': d['uid'], 'uname': d['username'],
+            'liverid': liverid,
+            'gift_info': '[大航海]' + d['toast_msg'].split('，')[-1],
+            'gift_cost': d['price'] / 1000,
+        })
+    elif cmd == 'SUPER_CHAT_MESSAGE':
+        d = msg['data']
+        row = {
+            'ts': d['ts'], 'uid': d['uid'], 'uname': d['user_info']['uname'],
+            'liverid': liverid,
+        }
+        emit('ablive_dm', {**row, 'text': '[%ssc] %s' % (d['price'], d['message'])})
+        emit('ablive_gf', {**row, 'gift_info': '[SuperChat]', 'gift_cost': d['price']})
+        emit('ablive_sc', {**row, 'text': d['message'], 'sc_price': d['price']})
+    elif cmd == 'USER_VIRTUAL_MVP':
+        d = msg['data']
+        emit('ablive_gf', {
+            'ts': d['timestamp'], 'uid': d['uid'], 'uname': d['uname'],
+            'liverid': liverid,
+            'gift_info': f'[MVP]{d["action"]}{d["goods_name"]}x{d["goods_num"]}',
+            'gift_cost': d['goods_price'] / 1000,
+        })
+
+
+def synthetic_packets(count: int = 200000) -> list[dict]:
+    kinds = [
+        {'cmd': 'DANMU_MSG:4:0:2:2:2:0',
+         'info': [[0, 1, 25, 16777215, 1, 0, 0, '', 0, 0, 0, '', 0, '{}'],
+                  '主播好', [123, 'user', 0], [], [], 0, 0, None, {},
+                  {'ts': 1700000000}]},
+        {'cmd': 'INTERACT_WORD',
+         'data': {'timestamp': 1700000000, 'uid': 123, 'uname': 'user'}},
+        {'cmd': 'SEND_GIFT',
+         'data': {'timestamp': 1700000000, 'uid': 123, 'uname': 'user',
+                  'giftName': '小花花', 'num': 2, 'discount_price': 100,
+                  'blind_gift': None, 'total_coin': 200}},
+        {'cmd': 'SUPER_CHAT_MESSAGE',
+         'data': {'ts': 1700000000, 'uid': 123, 'user_info': {'uname': 'user'},
+                  'price': 30, 'message': 'sc'}},
+        {'cmd': 'USER_TOAST_MSG',
+         'data': {'start_time': 1700000000, 'uid': 123, 'username': 'user',
+                  'toast_msg': '<%user%>开通了舰长，'
+                               '今天是TA陪伴主播的第1天',
+                  'price': 198000}},
+        {'cmd': 'USER_VIRTUAL_MVP',
+         'data': {'timestamp': 1700000000, 'uid': 123, 'uname': 'user',
+                  'action': '购买', 'goods_name': '小电视', 'goods_num': 1,
+                  'goods_price': 1000}},
+        {'cmd': 'ONLINE_RANK_COUNT', 'data': {'count': 1}},
+        {'cmd': 'WATCHED_CHANGE', 'data': {'num': 1}},
+    ]
+    weights = [50, 30, 10, 1, 1, 1, 5, 4]
+    packets = []
+    for kind, weight in zip(kinds, weights):
+        packets += [kind] * weight
+    return (packets * (count // len(packets) + 1))[:count]
+
+
+def load_packets(path: str) -> list[dict]:
+    with open(path, 'rb') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    packets = load_packets(sys.argv[1]) if len(sys.argv) > 1 else synthetic_packets()
+    for p in packets:
+        p['liverid'] = 1
+    # called the way Packer calls it
+    table_pack = Dispatcher(EVENT_ROUTES).dispatch
+
+    results = {}
+    best: dict[str, float] = {}
+    for _ in range(5):
+        for name, pack in (('if/elif', legacy_pack), ('table', table_pack)):
+            out = defaultdict(list)
+
+            def emit(table, row):
+                out[table].append(row)
+
+            t0 = time.perf_counter()
+            for msg in packets:
+                pack(1, msg, emit)
+            elapsed = time.perf_counter() - t0
+            results[name] = out
+            best[name] = min(best.get(name, elapsed), elapsed)
+            print(f'{name:>8}: {elapsed / len(packets) * 1e9:8.1f} ns/msg '
+                  f'{sum(map(len, out.values())):8d} rows')
+    assert results['if/elif'] == results['table']
+    for name, elapsed in best.items():
+        print(f'best {name:>8}: {elapsed / len(packets) * 1e9:8.1f} ns/msg')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Rows per second of the Storer insert strategies against a real server.
+
+    docker run -d --rm -p 3306:3306 -e MARIADB_ALLOW_EMPTY_ROOT_PASSWORD=1 \\
+        mariadb --local-infile=1
+    python -m benchmarks.storer_insert mysql+asyncmy://root:@127.0.0.1:3306/
+
+The schema `ablive_bench` is created on the server and dropped afterwards.
+Run it before switching `insert_strategy` away from `execute_many`.
+"""
+import asyncio
+import sys
+import time
+
+import databases
+import sqlalchemy as sa
+
+from ablive_client import bulk
+from ablive_client.packer import Packer
+
+SCHEMA = 'ablive_bench'
+ROWS = 100000
+
+
+def make_rows(count: int) -> list[dict]:
+    return [
+        {
+            'ts': 1700000000 + i // 100,
+            'uid': 10000 + i % 5000,
+            'uname': f'user{i % 5000}',
+            'liverid': 1 + i % 300,
+            'text': f'弹幕 {i}',
+        }
+        for i in range(count)
+    ]
+
+
+async def bench(dsn: str, strategy: str, chunk_size: int, rows: list[dict]):
+    db = databases.Database(dsn + SCHEMA, local_infile=strategy == bulk.LOAD_DATA)
+    await db.connect()
+    table = Packer.table_gen_map['ablive_dm'](f'{strategy}_{chunk_size}')
+    dialect = sa.dialects.mysql.dialect()
+    drop = sa.schema.DropTable(table, if_exists=True)
+    for ddl in (drop, sa.schema.CreateTable(table)):
+        await db.execute(str(ddl.compile(dialect=dialect)))
+
+    t0 = time.perf_counter()
+    if strategy == bulk.EXECUTE_MANY:
+        await db.execute_many(table.insert(), rows)
+    else:
+        if strategy == bulk.LOAD_DATA:
+            insert = bulk.insert_load_data
+        else:
+            insert = bulk.insert_multirow
+        async with db.connection() as conn:
+            await insert(conn.raw_connection, table, rows, chunk_size)
+    elapsed = time.perf_counter() - t0
+
+    count = await db.fetch_val(f'SELECT COUNT(*) FROM `{table.name}`')
+    assert count == len(rows), count
+    await db.disconnect()
+    print(f'{strategy:>12} chunk {chunk_size:>6}: {len(rows) / elapsed:10.0f} rows/s')
+
+
+async def main(dsn: str):
+    db = databases.Database(dsn)
+    await db.connect()
+    await db.execute(f'CREATE DATABASE IF NOT EXISTS {SCHEMA} CHARACTER SET utf8mb4')
+    await db.disconnect()
+
+    rows = make_rows(ROWS)
+    try:
+        await bench(dsn, bulk.EXECUTE_MANY, 0, rows[:ROWS // 10])
+        for chunk_size in (100, 1000, 5000):
+            await bench(dsn, bulk.MULTIROW, chunk_size, rows)
+        for chunk_size in (10000, ROWS):
+            await bench(dsn, bulk.LOAD_DATA, chunk_size, rows)
+    finally:
+        db = databases.Database(dsn)
+        await db.connect()
+        await db.execute(f'DROP DATABASE IF EXISTS {SCHEMA}')
+        await db.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1]))
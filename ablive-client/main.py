@@ -1,12 +1,19 @@
 import asyncio
 import logging
 import os
-import time
-from multiprocessing import Process
+import signal
+from multiprocessing.connection import Connection
 
+from ablive_client.blrec import DanmuInfoService, FrameDecoder, ReconnectGovernor
 from ablive_client.rooms_worker import RoomsWorker
 from ablive_client.packer import Packer
 from ablive_client.configs import Settings
+from ablive_client.exporter import MetricsServer, RoomCounter
+from ablive_client.handoff import Handoffs
+from ablive_client.metrics import LoopLagMonitor
+from ablive_client.remote import RowServer
+from ablive_client.snapshot import Snapshot
+from ablive_client.supervisor import READY, Supervisor
 
 settings = Settings() # type: ignore
 
@@ -26,47 +33,206 @@ config_logging()
 logger = logging.getLogger(__name__)
 
 
-def new_worker_process():
-    asyncio.run(worker_thread())
+def new_process(index: int, conn: Connection):
+    # the first `writers_num` slots are writers, the rest ingest
+    if index < settings.writers_num:
+        asyncio.run(writer_thread(index, conn))
+    else:
+        asyncio.run(worker_thread(index, conn))
+
+
+def new_packer(index: int, **overrides) -> Packer:
+    options = dict(
+        pool_size = settings.mysql_pool_size,
+        buffer_maxsize = settings.buffer_maxsize,
+        buffer_policies = settings.buffer_policies,
+        spill_dir = settings.spill_dir,
+        # by index, so a restarted worker picks up its own leftovers
+        spool_dir = (
+            os.path.join(settings.spool_dir, str(index)) if settings.spool_dir else None
+        ),
+        spool_options = dict(
+            segment_bytes = settings.spool_segment_bytes,
+            segment_seconds = settings.spool_segment_seconds,
+            fsync_interval = settings.spool_fsync_interval,
+        ),
+        sinks = settings.sinks,
+        sink_options = dict(
+            flush_rows = settings.flush_rows,
+            flush_bytes = settings.flush_bytes,
+            flush_max_age = settings.flush_max_age,
+            max_inflight = settings.max_inflight_flushes,
+        ),
+        storer_options = dict(
+            insert_strategy = settings.insert_strategy,
+            chunk_size = settings.insert_chunk_size,
+        ),
+        parquet_options = dict(
+            directory = settings.parquet_dir,
+            period = settings.parquet_period,
+            row_group_rows = settings.parquet_row_group_rows,
+            file_max_rows = settings.parquet_file_max_rows,
+            file_max_age = settings.parquet_file_max_age,
+        ),
+        dedup_window = settings.dedup_window,
+        dedup_max_keys = settings.dedup_max_keys,
+        uname_options = dict(
+            schema = settings.uname_schema,
+            cache_size = settings.uname_cache_size,
+        ) if settings.normalize_unames else None,
+        rollup_options = dict(
+            schema = settings.rollup_schema,
+            grace = settings.rollup_grace,
+        ) if settings.rollup else None,
+    )
+    options.update(overrides)
+    return Packer(settings.packer1_mysql_dsn, **options)
+
+
+def handle_sigterm():
+    # SIGTERM from the supervisor unwinds the process instead of killing it
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    except NotImplementedError:
+        # no loop signal handlers on Windows
+        signal.signal(
+            signal.SIGTERM, lambda signum, frame: loop.call_soon_threadsafe(task.cancel)
+        )
+
+
+async def start_metrics(index: int, lag: LoopLagMonitor, **sources):
+    if not settings.metrics_port:
+        return
+    server = MetricsServer(
+        settings.metrics_host,
+        settings.metrics_port + index,
+        lag,
+        **sources,
+    )
+    await server.start()
 
 
-async def worker_thread():
+async def writer_thread(index: int, conn: Connection):
+    handle_sigterm()
+    lag = LoopLagMonitor()
+    lag_task = asyncio.create_task(lag.run())
+    # events were deduplicated by the ingest processes already
+    packer = new_packer(index, dedup_window = 0)
+    await packer.run()
+    server = RowServer(
+        packer,
+        host = settings.writer_host,
+        port = settings.writer_port + index,
+    )
+    await server.start()
+    await start_metrics(index, lag, packer = packer, row_server = server)
+    logger.info(f'writer {index} listening on {server.port}')
+    conn.send(READY)
+    try:
+        await asyncio.gather(server.serve_forever(), lag_task)
+    finally:
+        await packer.close()
+
+
+async def notify_ready(
+    conn: Connection, rooms_worker: RoomsWorker, lag: LoopLagMonitor
+):
+    # rooms started and the loop no longer swamped by their handshakes
+    await rooms_worker.ready.wait()
+    await lag.wait_settled()
+    conn.send(READY)
+
+
+async def worker_thread(index: int, conn: Connection):
+    handle_sigterm()
+    lag = LoopLagMonitor()
+    # referenced here, or the loop may drop them
+    tasks = [asyncio.create_task(lag.run())]
+    # rooms_worker follows the server, the packer drops accordingly
+    handoffs = Handoffs(wait = settings.handoff_wait)
     rooms_worker = RoomsWorker(
         detail = f'{settings.machine_id}-{os.getpid()}',
         api_key = settings.server_api_key,
         add_room_interval = settings.add_room_interval,
+        onboard_concurrency = settings.onboard_concurrency,
         server_url = settings.server_url,
+        decoder = FrameDecoder(
+            inline_threshold = settings.decode_inline_threshold,
+            processes = settings.decode_processes,
+        ),
+        governor = ReconnectGovernor(
+            rate = settings.reconnect_rate,
+            burst = settings.reconnect_burst,
+        ),
+        danmu_info_service = DanmuInfoService(
+            ttl = settings.danmu_info_ttl,
+            concurrency = settings.danmu_info_concurrency,
+            rate = settings.danmu_info_rate,
+        ),
+        # by index like the spool, the next process in this slot resumes it
+        snapshot = Snapshot(
+            os.path.join(settings.snapshot_dir, f'{index}.json'),
+            max_age = settings.snapshot_max_age,
+        ) if settings.snapshot_dir else None,
+        handoffs = handoffs,
     )
 
-    packer = Packer(settings.packer1_mysql_dsn)
+    if settings.writers_num:
+        # rows go to a writer process, the ingest ones only parse
+        packer = new_packer(
+            index,
+            sinks = ['remote'],
+            remote_options = dict(
+                host = settings.writer_host,
+                port = settings.writer_port + index % settings.writers_num,
+            ),
+            handoffs = handoffs,
+        )
+    else:
+        packer = new_packer(index, handoffs = handoffs)
     rooms_worker.add_packer(packer)
+    room_counter = RoomCounter(settings.metrics_top_rooms)
+    if settings.metrics_port:
+        rooms_worker.add_packer(room_counter)
     await packer.run()
-
-    while True:
-        logger.info("new rooms-worker started")
-        try:
-            await rooms_worker.run()
-        except KeyboardInterrupt:
-            logger.warn("worker thread stoped")
-            break
-        except Exception as e:
-            logger.error(f'worker thread: {e}')
-            # time.sleep(5)
-            await asyncio.sleep(5)
+    await start_metrics(
+        index,
+        lag,
+        rooms_worker = rooms_worker,
+        room_counter = room_counter,
+        packer = packer,
+    )
+    tasks.append(asyncio.create_task(notify_ready(conn, rooms_worker, lag)))
+
+    # rooms_worker.run only fails with the server, its rooms stay up until
+    # the worker goes away
+    try:
+        while True:
+            logger.info("new rooms-worker started")
+            try:
+                await rooms_worker.run()
+            except KeyboardInterrupt:
+                logger.warn("worker thread stoped")
+                break
+            except Exception as e:
+                logger.error(f'worker thread: {e}')
+                # time.sleep(5)
+                await asyncio.sleep(5)
+    finally:
+        await rooms_worker.close()
+        await packer.close()
 
 
 def main():
-    p_list = []
-
-    for _ in range(settings.workers_num):
-        p = Process(target=new_worker_process)
-        p.start()
-        p_list.append(p)
-
-        time.sleep(90)
-
-    # p_sd.join()
-    [p.join() for p in p_list]
+    supervisor = Supervisor(
+        new_process,
+        settings.writers_num + settings.workers_num,
+        ready_timeout = settings.worker_ready_timeout,
+        backoff_cap = settings.worker_restart_backoff_cap,
+    )
+    supervisor.run()
 
     logger.error("over")
 
@@ -0,0 +1,70 @@
+import time
+import unittest
+from unittest import mock
+
+from ablive_client.dedup import Deduplicator
+from ablive_client.events import DEDUP_KEYS
+
+
+def gift(tid):
+    return {'cmd': 'SEND_GIFT', 'data': {'tid': tid, 'uid': 1}}
+
+
+def danmu(ts, uid, text, cmd='DANMU_MSG'):
+    return {'cmd': cmd, 'info': [[0, 1, 25, 0, ts], text, [uid, 'u']]}
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def test_second_copy_is_seen(self):
+        dedup = Deduplicator(DEDUP_KEYS)
+        self.assertFalse(dedup.seen(1, gift('a')))
+        self.assertTrue(dedup.seen(1, gift('a')))
+        self.assertFalse(dedup.seen(1, gift('b')))
+        stats = dedup.stats()
+        self.assertEqual(stats['checked'], {'SEND_GIFT': 3})
+        self.assertEqual(stats['dropped'], {'SEND_GIFT': 1})
+
+    def test_keyed_by_room(self):
+        dedup = Deduplicator(DEDUP_KEYS)
+        self.assertFalse(dedup.seen(1, gift('a')))
+        self.assertFalse(dedup.seen(2, gift('a')))
+
+    def test_command_suffix(self):
+        dedup = Deduplicator(DEDUP_KEYS)
+        self.assertFalse(dedup.seen(1, danmu(1000, 5, 'hi')))
+        self.assertTrue(dedup.seen(1, danmu(1000, 5, 'hi', 'DANMU_MSG:4:0:2:2:2:0')))
+        self.assertFalse(dedup.seen(1, danmu(1001, 5, 'hi')))
+
+    def test_unknown_and_unkeyed_pass(self):
+        dedup = Deduplicator(DEDUP_KEYS)
+        mvp = {'cmd': 'USER_VIRTUAL_MVP', 'data': {'timestamp': 1, 'uid': 1}}
+        self.assertFalse(dedup.seen(1, mvp))
+        self.assertFalse(dedup.seen(1, mvp))
+        broken = {'cmd': 'SEND_GIFT', 'data': {}}
+        self.assertFalse(dedup.seen(1, broken))
+        self.assertFalse(dedup.seen(1, broken))
+        self.assertEqual(dedup.unkeyed, 2)
+
+    def test_forgets_after_window(self):
+        now = time.monotonic()
+        with mock.patch('ablive_client.dedup.time') as clock:
+            clock.monotonic.return_value = now
+            dedup = Deduplicator(DEDUP_KEYS, window=100, buckets=10)
+            dedup.seen(1, gift('a'))
+            clock.monotonic.return_value = now + 95
+            self.assertTrue(dedup.seen(1, gift('a')))
+            # seen again at 95, kept until then plus the window
+            clock.monotonic.return_value = now + 200
+            self.assertFalse(dedup.seen(1, gift('a')))
+
+    def test_max_keys_rotates_early(self):
+        dedup = Deduplicator(DEDUP_KEYS, buckets=2, max_keys=4)
+        for tid in range(5):
+            dedup.seen(1, gift(tid))
+        self.assertLessEqual(dedup.stats()['keys'], 4)
+        self.assertFalse(dedup.seen(1, gift(0)))
+        self.assertTrue(dedup.seen(1, gift(4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import time
+import unittest
+from unittest import mock
+
+from ablive_client.handoff import Handoffs
+
+
+class HandoffsTest(unittest.TestCase):
+    def test_rooms_without_handoff_keep_all(self):
+        handoffs = Handoffs()
+        self.assertTrue(handoffs.keeps(1, 100))
+        self.assertIsNone(handoffs.side(1))
+
+    def test_split_at_cutover(self):
+        handoffs = Handoffs()
+        handoffs.receive(1, 100)
+        handoffs.release(2, 100)
+        self.assertFalse(handoffs.keeps(1, 99))
+        self.assertTrue(handoffs.keeps(1, 100))
+        self.assertTrue(handoffs.keeps(2, 99))
+        self.assertFalse(handoffs.keeps(2, 100))
+        stats = handoffs.stats()
+        self.assertEqual((stats['dropped_in'], stats['dropped_out']), (1, 1))
+
+    def test_awaiting_cutover(self):
+        handoffs = Handoffs()
+        handoffs.receive(1, None)
+        handoffs.release(2, None)
+        self.assertTrue(handoffs.awaiting(1))
+        self.assertFalse(handoffs.awaiting(2))
+        self.assertFalse(handoffs.keeps(1, 50))
+        self.assertTrue(handoffs.keeps(2, 50))
+        handoffs.receive(1, 100)
+        self.assertFalse(handoffs.awaiting(1))
+
+    def test_gives_up_waiting(self):
+        now = time.monotonic()
+        with mock.patch('ablive_client.handoff.time') as clock:
+            clock.monotonic.return_value = now
+            handoffs = Handoffs(wait=90)
+            handoffs.receive(1, None)
+            clock.monotonic.return_value = now + 91
+            self.assertTrue(handoffs.keeps(1, 50))
+        self.assertEqual(handoffs.gave_up, 1)
+        self.assertNotIn(1, handoffs)
+
+    def test_side_change_is_new_handoff(self):
+        handoffs = Handoffs()
+        handoffs.release(1, 100)
+        handoffs.receive(1, None)
+        self.assertEqual(handoffs.side(1), Handoffs.IN)
+        self.assertTrue(handoffs.awaiting(1))
+
+    def test_prune(self):
+        handoffs = Handoffs()
+        handoffs.receive(1, 100)
+        handoffs.receive(2, 100)
+        handoffs.release(3, 100)
+        handoffs.release(4, 100)
+        # 2 no longer listed, 3 unlisted but still running, 4 gone
+        handoffs.prune({1}, set(), running={3})
+        self.assertIn(1, handoffs)
+        self.assertNotIn(2, handoffs)
+        self.assertIn(3, handoffs)
+        self.assertNotIn(4, handoffs)
+
+
+if __name__ == '__main__':
+    unittest.main()
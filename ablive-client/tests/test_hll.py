@@ -0,0 +1,40 @@
+import unittest
+
+from ablive_client.hll import HyperLogLog
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def test_small_sets_are_exact(self):
+        hll = HyperLogLog(p=10)
+        for uid in range(100):
+            hll.add(uid)
+            hll.add(uid)
+        self.assertEqual(hll.count(), 100)
+        self.assertIsNone(hll._registers)
+
+    def test_densifies_past_threshold(self):
+        hll = HyperLogLog(p=10)
+        for uid in range((1 << 10) // 8 + 1):
+            hll.add(uid)
+        self.assertIsNone(hll._exact)
+        self.assertIsNotNone(hll._registers)
+        self.assertAlmostEqual(hll.count(), 129, delta=129 * 0.1)
+
+    def test_estimate_within_error(self):
+        for n in (1000, 50000, 300000):
+            hll = HyperLogLog(p=12)
+            for uid in range(10**9, 10**9 + n):
+                hll.add(uid)
+            # ~1.6% standard error at p=12, allow 4 of them
+            self.assertAlmostEqual(hll.count(), n, delta=n * 0.065)
+
+    def test_duplicates_not_counted(self):
+        hll = HyperLogLog(p=10)
+        for _ in range(3):
+            for uid in range(5000):
+                hll.add(uid * 7919)
+        self.assertAlmostEqual(hll.count(), 5000, delta=5000 * 0.13)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from ablive_client.blrec.reconnect import ReconnectGovernor, TokenBucket
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_is_immediate(self):
+        bucket = TokenBucket(rate=1, burst=5)
+        t0 = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - t0, 0.05)
+        self.assertEqual(bucket.waiting, 0)
+
+    async def test_waiters_paced_by_rate(self):
+        bucket = TokenBucket(rate=50, burst=1)
+        await bucket.acquire()
+        t0 = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(5)))
+        # 5 tokens at 50/s
+        self.assertGreaterEqual(time.monotonic() - t0, 0.09)
+
+    async def test_waiters_served_in_order(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        await bucket.acquire()
+        order = []
+
+        async def take(i):
+            await bucket.acquire()
+            order.append(i)
+
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.create_task(take(i)))
+            await asyncio.sleep(0)
+        self.assertEqual(bucket.waiting, 5)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, list(range(5)))
+        self.assertEqual(bucket.waiting, 0)
+
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        bucket = TokenBucket(rate=20, burst=1)
+        await bucket.acquire()
+        first = asyncio.create_task(bucket.acquire())
+        second = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        first.cancel()
+        t0 = time.monotonic()
+        await second
+        # the token meant for the first goes to the second
+        self.assertLess(time.monotonic() - t0, 0.08)
+        self.assertTrue(first.cancelled())
+
+    async def test_token_returned_when_cancelled_after_wakeup(self):
+        bucket = TokenBucket(rate=20, burst=2)
+        await bucket.acquire()
+        await bucket.acquire()
+
+        async def first():
+            await bucket.acquire()
+            # woken in the same pass, not yet run
+            second.cancel()
+
+        first_task = asyncio.create_task(first())
+        second = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        # both tokens come in before the waker runs again
+        time.sleep(0.15)
+        await first_task
+        with self.assertRaises(asyncio.CancelledError):
+            await second
+        t0 = time.monotonic()
+        await bucket.acquire()
+        self.assertLess(time.monotonic() - t0, 0.02)
+
+
+class ReconnectGovernorTest(unittest.IsolatedAsyncioTestCase):
+    def test_backoff_bounds(self):
+        governor = ReconnectGovernor(backoff_base=0.5, backoff_cap=10)
+        delay = 0.0
+        for _ in range(100):
+            prev, delay = delay, governor.backoff(delay)
+            self.assertGreaterEqual(delay, 0.5)
+            self.assertLessEqual(delay, min(10, max(0.5, prev * 3)))
+
+    def test_breaker_opens_after_threshold(self):
+        governor = ReconnectGovernor(failure_threshold=3, cooldown=30)
+        for _ in range(2):
+            governor.record_failure('a')
+        self.assertTrue(governor.available('a'))
+        governor.record_failure('a')
+        self.assertFalse(governor.available('a'))
+        self.assertTrue(governor.available('b'))
+        self.assertEqual(governor.stats()['open_circuits'], 1)
+        self.assertAlmostEqual(governor.retry_after(['a', 'b']), 30, delta=1)
+        self.assertEqual(governor.retry_after(['b']), 0.0)
+
+    def test_half_open_after_cooldown(self):
+        governor = ReconnectGovernor(failure_threshold=3, cooldown=30)
+        now = time.monotonic()
+        with mock.patch('ablive_client.blrec.reconnect.time') as clock:
+            clock.monotonic.return_value = now
+            for _ in range(3):
+                governor.record_failure('a')
+            clock.monotonic.return_value = now + 31
+            self.assertTrue(governor.available('a'))
+            # one more failure opens it again
+            governor.record_failure('a')
+            self.assertFalse(governor.available('a'))
+
+    def test_success_closes_breaker(self):
+        governor = ReconnectGovernor(failure_threshold=1)
+        governor.record_failure('a')
+        self.assertFalse(governor.available('a'))
+        governor.record_success('a')
+        self.assertTrue(governor.available('a'))
+        self.assertEqual(governor.failures, 1)
+
+    async def test_acquire_counts_attempts(self):
+        governor = ReconnectGovernor(rate=1000, burst=3)
+        for _ in range(3):
+            await governor.acquire()
+        self.assertEqual(governor.stats()['attempts'], 3)
+        self.assertEqual(governor.stats()['queue_depth'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
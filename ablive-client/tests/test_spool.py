@@ -0,0 +1,171 @@
+import os
+import tempfile
+import unittest
+
+from ablive_client.buffer import RowBuffer
+from ablive_client.spool import Spool
+
+
+def rows(start, stop):
+    return [{'ts': i, 'text': 'x' * 20} for i in range(start, stop)]
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def spool(self, **options):
+        options.setdefault('segment_bytes', 200)
+        options.setdefault('segment_seconds', 3600)
+        return Spool(self.dir, **options)
+
+    def segments(self):
+        return sorted(n for n in os.listdir(self.dir) if n.endswith('.seg'))
+
+    def test_acked_segments_are_removed_once_sealed(self):
+        spool = self.spool()
+        segs = [spool.append(row) for row in rows(0, 20)]
+        self.assertGreater(len(set(segs)), 2)
+        acks = {}
+        for seg in segs:
+            acks[seg] = acks.get(seg, 0) + 1
+        spool.ack(acks)
+        # only the open one is left
+        self.assertEqual(self.segments(), [f'{segs[-1]:012d}.seg'])
+        self.assertEqual(spool.stats()['unacked'], 0)
+        spool.close()
+
+    def test_replay_counts_left_over_rows(self):
+        spool = self.spool()
+        segs = [spool.append(row) for row in rows(0, 12)]
+        spool.ack({segs[0]: segs.count(segs[0])})
+        spool.close()
+
+        spool = self.spool()
+        replayed = list(spool.replay())
+        self.assertEqual(sum(count for _, count in replayed), 12 - segs.count(segs[0]))
+        self.assertNotIn(segs[0], dict(replayed))
+        spool.close()
+
+    def test_replay_cuts_torn_tail(self):
+        spool = self.spool(segment_bytes=1 << 20)
+        seg = spool.append({'ts': 1})
+        spool.append({'ts': 2})
+        spool.close()
+        with open(os.path.join(self.dir, f'{seg:012d}.seg'), 'ab') as f:
+            f.write(b'{"ts": 3')
+
+        spool = self.spool()
+        self.assertEqual(list(spool.replay()), [(seg, 2)])
+        got, runs, _ = spool.read((seg, 0), 10)
+        self.assertEqual(got, [{'ts': 1}, {'ts': 2}])
+        self.assertEqual(runs, [[seg, 2]])
+        spool.close()
+
+    def test_read_across_segments_from_cursor(self):
+        spool = self.spool()
+        cursor = spool.tell()
+        segs = [spool.append(row) for row in rows(0, 12)]
+        got, runs, cursor = spool.read(cursor, 5)
+        self.assertEqual(got, rows(0, 5))
+        got2, runs2, cursor = spool.read(cursor, 100)
+        self.assertEqual(got2, rows(5, 12))
+        counted = {}
+        for seg, count in runs + runs2:
+            counted[seg] = counted.get(seg, 0) + count
+        self.assertEqual(counted, {s: segs.count(s) for s in set(segs)})
+        # caught up, nothing more until appended
+        self.assertEqual(spool.read(cursor, 10)[0], [])
+        spool.append({'ts': 99})
+        self.assertEqual(spool.read(cursor, 10)[0], [{'ts': 99}])
+        spool.close()
+
+    def test_broken_line_is_settled(self):
+        spool = self.spool(segment_bytes=1 << 20)
+        seg = spool.append({'ts': 1})
+        spool._file.write(b'not json\n')
+        spool._unacked[seg] += 1
+        spool.append({'ts': 2})
+        got, runs, _ = spool.read((seg, 0), 10)
+        self.assertEqual(got, [{'ts': 1}, {'ts': 2}])
+        self.assertEqual(runs, [[seg, 2]])
+        self.assertEqual(spool.stats()['unacked'], 2)
+        spool.close()
+
+
+class SpooledBufferTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def buffer(self, maxsize=5):
+        spool = Spool(self.dir, segment_bytes=200, segment_seconds=3600)
+        return RowBuffer('t', maxsize=maxsize, spool=spool)
+
+    def test_rows_past_limit_read_back_in_order(self):
+        buffer = self.buffer()
+        for row in rows(0, 20):
+            buffer.put_nowait(row)
+        self.assertEqual(len(buffer._rows), 5)
+        self.assertEqual(buffer.qsize(), 20)
+        self.assertFalse(buffer.paused)
+
+        got = []
+        while buffer.qsize():
+            batch, acks = buffer.drain()
+            self.assertEqual(sum(acks.values()), len(batch))
+            got.extend(batch)
+            buffer.ack(acks)
+        self.assertEqual(got, rows(0, 20))
+        self.assertEqual(buffer.spool.stats()['unacked'], 0)
+        buffer.close()
+
+    def test_requeue_keeps_acks(self):
+        buffer = self.buffer(maxsize=0)
+        for row in rows(0, 10):
+            buffer.put_nowait(row)
+        batch, acks = buffer.drain(4)
+        buffer.requeue(batch, acks)
+        batch, acks = buffer.drain()
+        self.assertEqual(batch, rows(0, 10))
+        self.assertEqual(sum(acks.values()), 10)
+        buffer.ack(acks)
+        self.assertEqual(buffer.spool.stats()['unacked'], 0)
+        buffer.close()
+
+    def test_replay_loads_what_fits(self):
+        buffer = self.buffer(maxsize=0)
+        for row in rows(0, 12):
+            buffer.put_nowait(row)
+        batch, acks = buffer.drain(3)
+        buffer.ack(acks)
+        buffer.close()
+
+        buffer = self.buffer(maxsize=4)
+        # at-least-once: rows of a partly acked segment come back too
+        n = buffer.replay()
+        self.assertGreaterEqual(n, 9)
+        self.assertEqual(len(buffer._rows), 4)
+        got = []
+        while buffer.qsize():
+            batch, acks = buffer.drain()
+            got.extend(batch)
+            buffer.ack(acks)
+        self.assertEqual(len(got), n)
+        self.assertEqual(got[-9:], rows(3, 12))
+        buffer.close()
+
+        buffer = self.buffer()
+        self.assertEqual(buffer.replay(), 0)
+        buffer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
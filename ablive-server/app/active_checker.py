@@ -1,6 +1,7 @@
 import asyncio
 import logging
 
+from app.crud.handoff import Handoff
 from app.crud.worker import Worker
 
 logger = logging.getLogger(__name__)
@@ -11,3 +12,7 @@ async def active_checker():
         await asyncio.sleep(60)
         del_cnt = await Worker.remove_expired(60)
         logger.debug(f'active checker removed {del_cnt} workers')
+        # the old workers of stuck handoffs get their lists without the rooms
+        if from_ids := await Handoff.expire():
+            await Worker.recheck(from_ids)
+            logger.info(f'{len(from_ids)} workers had handoffs time out')
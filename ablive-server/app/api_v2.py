@@ -1,19 +1,43 @@
 
+from typing import Optional
+
 from fastapi import APIRouter, Depends
+from pydantic import BaseModel
 
+from app.crud.handoff import Handoff
 from app.crud.worker import Worker
 from app.core.security import verify_api_key
 
 router = APIRouter()
 
 
+class Progress(BaseModel):
+    """How far a worker got with the room list it was given last."""
+    adding: int = 0
+    removing: int = 0
+    started: int = 0
+    failed: int = 0
+    removed: int = 0
+    # rooms connected or released since the last report, for the handoffs
+    connected_ids: list[int] = []
+    released_ids: list[int] = []
+
+
+class Revival(BaseModel):
+    """A restarted worker's previous id and the rooms it resumed."""
+    worker_id: str
+    rooms: list[tuple[int, int]] = []
+
+
 @router.get("/ping")
 async def ping():
     return 'pong'
 
 
 @router.post("/reg", dependencies=[Depends(verify_api_key)])
-async def reg_worker(detail: str = ''):
+async def reg_worker(detail: str = '', revival: Optional[Revival] = None):
+    if revival and await Worker.revive(revival.worker_id, detail, revival.rooms):
+        return {'ok': True, 'worker_id': revival.worker_id}
     if worker_id := await Worker.add(detail):
         return {'ok': True, 'worker_id': str(worker_id)}
     else:
@@ -21,10 +45,22 @@ async def reg_worker(detail: str = ''):
 
 
 @router.post("/{worker_id}")
-async def worker_heartbeat(worker_id: str):
+async def worker_heartbeat(worker_id: str, progress: Optional[Progress] = None):
+    if not await Worker.active(
+        worker_id,
+        progress.model_dump(exclude={'connected_ids', 'released_ids'})
+        if progress else None,
+    ):
+        return {'ok': False}
+    if progress:
+        await Handoff.connected(worker_id, progress.connected_ids)
+        await Handoff.released(worker_id, progress.released_ids)
+    handoffs = await Handoff.state(worker_id)
     return {
-        'ok': await Worker.active(worker_id),
-        'interval': 10,
+        'ok': True,
+        # shorter while rooms change hands, so a cutover is heard in time
+        'interval': 5 if any(handoffs.values()) else 10,
+        **handoffs,
     }
 
 
@@ -33,14 +69,25 @@ async def get_worker_rooms(worker_id: str):
     if not await Worker.active(worker_id):
         return {'ok': False}
     if await Worker.is_checked(worker_id):
+        handoffs = await Handoff.state(worker_id)
         return {
             'ok': True,
-            'interval': 20,
+            'interval': 5 if any(handoffs.values()) else 20,
+            **handoffs,
         }
     else:
         worker = await Worker.retrieve(worker_id)
+        assigned = set(map(tuple, worker['rooms']))
+        await Handoff.track_moves(
+            worker_id, assigned, set(map(tuple, worker.get('served', [])))
+        )
+        # rooms given to another worker stay until it has connected them
+        rooms = list(assigned | await Handoff.retained(worker_id))
+        await Worker.serve(worker_id, rooms)
+        handoffs = await Handoff.state(worker_id)
         return {
             'ok': True,
-            'interval': 40,
-            'rooms': worker['rooms'],
+            'interval': 5 if any(handoffs.values()) else 40,
+            'rooms': rooms,
+            **handoffs,
         }
@@ -0,0 +1,205 @@
+import time
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from bson.objectid import ObjectId
+
+from app.core.database import mongo_client
+
+handoffs_coll = mongo_client['bili_liveroom']['handoffs']
+workers_coll = mongo_client['bili_liveroom']['workers']
+
+
+class Handoff:
+    """A room moving from one worker to another, make-before-break.
+
+    The old worker keeps the room until the new one has connected it. Then
+    both agree on a cutover ts: the new worker stores the room's events from
+    the cutover on, the old one those before, and releases the room at
+    `release_at`.
+    """
+
+    PENDING = 'pending'
+    CUTOVER = 'cutover'
+    DONE = 'done'
+    TIMED_OUT = 'timed_out'
+    OPEN = [PENDING, CUTOVER]
+
+    # the new worker has this long to connect, the old one to release
+    TIMEOUT = 180
+    # seconds from the new worker connecting to the cutover, enough for the
+    # old one to hear of it at the shorter heartbeat interval
+    CUTOVER_DELAY = 15
+    RELEASE_DELAY = 5
+    # a move is only tracked once, however often the lists are served
+    MEMORY = 600
+
+    @staticmethod
+    async def track_moves(
+        worker_id: str,
+        assigned: set[tuple[int, int]],
+        served: set[tuple[int, int]],
+    ) -> None:
+        """Opens the handoffs behind a new room list of `worker_id`."""
+        moves: list[tuple[tuple[int, int], ObjectId, ObjectId]] = []
+        _id = ObjectId(worker_id)
+
+        # rooms it takes over that another worker still runs
+        if added := list(map(list, assigned - served)):
+            async for other in workers_coll.find(
+                {"_id": {"$ne": _id}, "served": {"$in": added}},
+                {"served": 1, "rooms": 1},
+            ):
+                still_assigned = set(map(tuple, other['rooms']))
+                for room in map(tuple, other['served']):
+                    if room in assigned and room not in still_assigned:
+                        moves.append((room, other['_id'], _id))
+
+        # rooms it runs that went to another worker
+        if removed := list(map(list, served - assigned)):
+            async for other in workers_coll.find(
+                {"_id": {"$ne": _id}, "rooms": {"$in": removed}},
+                {"rooms": 1},
+            ):
+                for room in map(tuple, other['rooms']):
+                    if room in served and room not in assigned:
+                        moves.append((room, _id, other['_id']))
+
+        now = datetime.utcnow()
+        for room, from_id, to_id in moves:
+            await handoffs_coll.update_one({
+                    "liverid": room[0],
+                    "from": from_id,
+                    "to": to_id,
+                    "created": {"$gt": now - timedelta(seconds=Handoff.MEMORY)},
+                }, {
+                    "$setOnInsert": {
+                        "room": list(room),
+                        "created": now,
+                        "status": Handoff.PENDING,
+                    }
+                },
+                upsert=True
+            )
+
+    @staticmethod
+    async def retained(worker_id: str) -> set[tuple[int, int]]:
+        """Rooms `worker_id` keeps running for open handoffs."""
+        return {
+            tuple(h['room'])
+            async for h in handoffs_coll.find(
+                {"from": ObjectId(worker_id), "status": {"$in": Handoff.OPEN}},
+                {"room": 1},
+            )
+        }
+
+    @staticmethod
+    async def connected(worker_id: str, liverids: Iterable[int]) -> None:
+        """The new worker connected these rooms, sets their cutover."""
+        liverids = list(liverids)
+        if not liverids:
+            return
+        now = datetime.utcnow()
+        # an event ts, unix seconds like the ones in the danmaku
+        cutover = int(time.time()) + Handoff.CUTOVER_DELAY
+        await handoffs_coll.update_many({
+                "to": ObjectId(worker_id),
+                "liverid": {"$in": liverids},
+                "status": Handoff.PENDING,
+            }, {
+                "$set": {
+                    "status": Handoff.CUTOVER,
+                    "connected_at": now,
+                    "cutover": cutover,
+                    "release_at": cutover + Handoff.RELEASE_DELAY,
+                }
+            }
+        )
+        # connected only after the old worker let go, that was a gap
+        async for h in handoffs_coll.find({
+            "to": ObjectId(worker_id),
+            "liverid": {"$in": liverids},
+            "status": Handoff.TIMED_OUT,
+            "released_at": {"$exists": True},
+            "connected_at": {"$exists": False},
+        }):
+            await handoffs_coll.update_one({"_id": h['_id']}, {"$set": {
+                "connected_at": now,
+                "gap": (now - h['released_at']).total_seconds(),
+            }})
+
+    @staticmethod
+    async def released(worker_id: str, liverids: Iterable[int]) -> None:
+        """The old worker let go of these rooms."""
+        liverids = list(liverids)
+        if not liverids:
+            return
+        now = datetime.utcnow()
+        rooms = []
+        async for h in handoffs_coll.find({
+            "from": ObjectId(worker_id),
+            "liverid": {"$in": liverids},
+            "released_at": {"$exists": False},
+        }):
+            update: dict = {"released_at": now}
+            if h['status'] == Handoff.CUTOVER:
+                # both ran the room from the new one connecting to this
+                update.update(
+                    status=Handoff.DONE,
+                    overlap=(now - h['connected_at']).total_seconds(),
+                    gap=0,
+                )
+            await handoffs_coll.update_one({"_id": h['_id']}, {"$set": update})
+            rooms.append(h['room'])
+        if rooms:
+            await workers_coll.update_one(
+                {"_id": ObjectId(worker_id)},
+                {"$pull": {"served": {"$in": rooms}}},
+            )
+
+    @staticmethod
+    async def state(worker_id: str) -> dict[str, list]:
+        """What a worker is told with every heartbeat.
+
+        `handoff_in` are [liverid, cutover] of the rooms it takes over,
+        `handoff_out` [liverid, cutover, release_at] of those it gives up;
+        both are None until the new worker has connected.
+        """
+        _id = ObjectId(worker_id)
+        handoff_in, handoff_out = [], []
+        async for h in handoffs_coll.find({
+            "$or": [{"from": _id}, {"to": _id}],
+            "status": {"$in": Handoff.OPEN},
+        }):
+            if h['to'] == _id:
+                handoff_in.append([h['liverid'], h.get('cutover')])
+            else:
+                handoff_out.append(
+                    [h['liverid'], h.get('cutover'), h.get('release_at')]
+                )
+        return {'handoff_in': handoff_in, 'handoff_out': handoff_out}
+
+    @staticmethod
+    async def expire() -> list[ObjectId]:
+        """Gives up on handoffs that got stuck, returns the old workers,
+        whose room lists have to be sent again."""
+        # the new worker had TIMEOUT to connect, the old one to release
+        stuck = {"$or": [
+            {
+                "status": Handoff.PENDING,
+                "created": {
+                    "$lt": datetime.utcnow() - timedelta(seconds=Handoff.TIMEOUT)
+                },
+            },
+            {
+                "status": Handoff.CUTOVER,
+                "release_at": {"$lt": time.time() - Handoff.TIMEOUT},
+            },
+        ]}
+        from_ids = list({
+            h['from'] async for h in handoffs_coll.find(stuck, {"from": 1})
+        })
+        await handoffs_coll.update_many(
+            stuck, {"$set": {"status": Handoff.TIMED_OUT}}
+        )
+        return from_ids
@@ -37,11 +37,14 @@ class Worker:
 
     @staticmethod
     @validate_workerid
-    async def active(worker_id: str) -> bool:
+    async def active(worker_id: str, progress: Optional[dict] = None) -> bool:
         result = await workers_coll.update_one({
                 "_id": ObjectId(worker_id)
             }, {
-                "$set": Worker.Status.alive()
+                "$set": {
+                    **Worker.Status.alive(),
+                    **({"progress": progress} if progress is not None else {}),
+                }
             },
             upsert=False
         )
@@ -64,6 +67,26 @@ class Worker:
         worker = await workers_coll.find_one({"_id": ObjectId(worker_id)})
         return worker
 
+    @staticmethod
+    @validate_workerid
+    async def serve(worker_id: str, rooms: list[tuple[int, int]]) -> None:
+        # what the worker runs, unlike `rooms` which the scheduler assigns
+        await workers_coll.update_one({
+                "_id": ObjectId(worker_id)
+            }, {
+                "$set": {"served": rooms}
+            }
+        )
+
+    @staticmethod
+    async def recheck(worker_ids: list[ObjectId]) -> None:
+        await workers_coll.update_many({
+                "_id": {"$in": worker_ids}
+            }, {
+                "$set": {"checked": 0}
+            }
+        )
+
     @staticmethod
     async def add(worker_detail: str) -> ObjectId:
         result = await workers_coll.insert_one({
@@ -73,10 +96,38 @@ class Worker:
                 **Worker.Status.CHECKED,
                 "length": 0,
                 "rooms": [],
+                "served": [],
             },
         )
         return result.inserted_id
 
+    @staticmethod
+    async def revive(
+        worker_id: str, worker_detail: str, rooms: list[tuple[int, int]]
+    ) -> bool:
+        if not ObjectId.is_valid(worker_id):
+            return False
+        # a record that expired meanwhile comes back with the worker's rooms,
+        # a live one keeps its own and sends them to the worker again
+        await workers_coll.update_one({
+                "_id": ObjectId(worker_id)
+            }, {
+                "$set": {
+                    "detail": worker_detail,
+                    **Worker.Status.alive(),
+                    "checked": 0,
+                },
+                "$setOnInsert": {
+                    "created": datetime.utcnow(),
+                    "length": len(rooms),
+                    "rooms": rooms,
+                    "served": rooms,
+                },
+            },
+            upsert=True
+        )
+        return True
+
     @staticmethod
     async def remove_expired(seconds: int) -> int:
         result = await workers_coll.delete_many(Worker.Status.expired(seconds))